@@ -0,0 +1,9 @@
+import os
+import sys
+
+# модули бота импортируются от каталога src, как в src/main.py
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+)
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
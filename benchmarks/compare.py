@@ -0,0 +1,58 @@
+"""
+Сравнить два JSON-отчёта benchmarks.load / benchmarks.micro:
+
+    python -m benchmarks.compare old.json new.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+from .report import LOWER_IS_BETTER, SUMMARY_KEYS
+
+COMPARED = (*LOWER_IS_BETTER, "throughput")
+
+
+def compare(old: Dict, new: Dict, threshold: float) -> List[str]:
+    """Строки сравнения; регрессии хуже threshold процентов помечены '!'"""
+    lines = []
+    old_rows = {row["case"]: row for row in old["results"]}
+    for row in new["results"]:
+        base = old_rows.get(row["case"])
+        if base is None:
+            lines.append(f"  {row['case']}: новый случай")
+            continue
+        for key in COMPARED:
+            if key not in row or not base.get(key):
+                continue
+            change = (row[key] - base[key]) / base[key] * 100
+            worse = change if key in LOWER_IS_BETTER else -change
+            mark = "!" if worse > threshold else " "
+            # mean/max и размеры файлов - только если заметно ухудшились
+            if mark == "!" or key in SUMMARY_KEYS + ("seconds", "peak_rss_mb"):
+                lines.append(
+                    f"{mark} {row['case']:<24} {key:<12} "
+                    f"{base[key]:>10.2f} -> {row[key]:>10.2f} ({change:+.1f}%)"
+                )
+    return lines
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="в процентах")
+    args = parser.parse_args()
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('commit') or '?'} -> {new.get('commit') or '?'}")
+    lines = compare(old, new, args.threshold)
+    print("\n".join(lines))
+    return 1 if any(line.startswith("!") for line in lines) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import functools
+import hashlib
+import random
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from rag.embedding import Embedder, EmbedderConfig
+
+WORDS = (
+    "function method macro type struct module array tuple dict string "
+    "operator infix broadcast dispatch package import export const mutable "
+    "iterate index range loop closure generator channel task thread "
+    "allocation performance inference compiler keyword argument return "
+    "функция метод макрос тип массив модуль оператор пакет цикл поток "
+    "push! @time @inbounds map filter reduce println sum length"
+).split()
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    """Абзацы из словаря Julia-документации, предложения по 8-20 слов"""
+    sentences, left = [], words
+    while left > 0:
+        n = min(left, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(n))
+        sentences.append(sentence.capitalize() + ".")
+        left -= n
+    return " ".join(sentences)
+
+
+def synthetic_chunks(n: int, words=80, seed=0, start=0) -> List[Tuple[str, Dict]]:
+    rng = random.Random(seed + start)
+    return [
+        (synthetic_text(rng, words), {"source": f"doc{i // 500}.pdf", "page": i % 500})
+        for i in range(start, start + n)
+    ]
+
+
+def synthetic_document(blocks: int, words=80, blocks_per_page=10, seed=0) -> str:
+    """Текст в формате extract_text: маркеры [PAGE n], блоки через пустую строку"""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(blocks):
+        if i % blocks_per_page == 0:
+            parts.append(f"[PAGE {i // blocks_per_page + 1}]")
+        parts.append(synthetic_text(rng, rng.randint(words // 2, words * 2)))
+    return "\n\n".join(parts)
+
+
+def synthetic_queries(n: int, seed=1) -> List[str]:
+    rng = random.Random(seed)
+    return [synthetic_text(rng, rng.randint(3, 10)) for _ in range(n)]
+
+
+@functools.lru_cache(maxsize=65536)
+def _token_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode()).digest()[:8])
+
+
+class HashEmbedder(Embedder):
+    """
+    Детерминированные вектора по хешу токенов: стоимость индекса и поиска
+    без загрузки модели. Качество выдачи не моделирует.
+    """
+
+    def __init__(self, dim=384):
+        super().__init__(EmbedderConfig(model_name="hash"))
+        self._dim = dim
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                h = _token_hash(token)
+                out[row, h % self._dim] += 1.0 if h & 1 << 63 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-6)
@@ -0,0 +1,58 @@
+"""
+HNSW и IVF-PQ против точного поиска на корпусе текущей версии индекса:
+recall@10 и мс на запрос. Запросы - зашумлённые вектора самого корпуса.
+
+    python -m benchmarks.indexes --index-dir rag_index --limit 20000
+"""
+
+import argparse
+import itertools
+import logging
+import sys
+
+import numpy as np
+
+from rag.chunk_store import ChunkStore
+from rag.embedding import EmbedderConfig, make_embedder
+from rag.faiss_index import HnswConfig, IndexConfig, IvfPqConfig, compare_indexes
+from rag.rag import current_paths
+
+from .report import write_report
+
+CONFIGS = [
+    IndexConfig("hnsw", hnsw=HnswConfig(ef_search=32)),
+    IndexConfig("hnsw", hnsw=HnswConfig(ef_search=128)),
+    IndexConfig("ivfpq", ivfpq=IvfPqConfig(nprobe=8)),
+    IndexConfig("ivfpq", ivfpq=IvfPqConfig(nprobe=32)),
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--index-dir", required=True, help="RAG_INDEX_DIR бота")
+    parser.add_argument("--limit", type=int, default=20000, help="чанков корпуса")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", default="-", help="файл JSON, '-' - stdout")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    paths = current_paths(args.index_dir)
+    if paths is None:
+        print(f"В {args.index_dir} нет собранной версии индекса", file=sys.stderr)
+        return 1
+    chunks = itertools.islice(ChunkStore(paths["meta_path"]), args.limit)
+    corpus = make_embedder(EmbedderConfig()).encode([c.content for c in chunks])
+    rng = np.random.default_rng(0)
+    qs = corpus[rng.choice(len(corpus), min(args.queries, len(corpus)), replace=False)]
+    qs = qs + rng.normal(0, 0.01, qs.shape).astype(np.float32)
+
+    rows = [
+        {"case": row.pop("index"), **row}
+        for row in compare_indexes(corpus, qs, CONFIGS)
+    ]
+    write_report("indexes", vars(args), rows, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Нагрузочный тест BotHandlers: синтетические Update с заданной частотой,
+Yandex API - локальная заглушка, Telegram - бот без сети.
+
+    python -m benchmarks.load --rate 20 --count 500 --users 50 --rag-share 0.3
+"""
+
+import argparse
+import asyncio
+import datetime
+import logging
+import random
+import tempfile
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from telegram import Chat, Message, Update, User
+
+from bot.bot import BotHandlers
+from bot.scheduler import RequestScheduler, SchedulerConfig
+from gpt.base_yandex_gpt import YandexGPTConfig
+from gpt.batcher import BatchConfig
+from gpt.client import HttpClientConfig, SharedHttpClient
+from gpt.iam import IamTokenProvider, StaticTokenProvider
+from gpt.metrics import Metrics
+from gpt.yandex_gpt import REFUSAL_MESSAGE, YandexGPTBot
+from rag.rag import VectorStore
+
+from .corpus import HashEmbedder, synthetic_chunks, synthetic_queries
+from .report import peak_rss_mb, print_table, summarize, write_report
+from .stub_api import StubYandexApi, add_stub_arguments, stub_config
+
+
+@dataclass
+class Reply:
+    """Что бот отправил в чат одного Update"""
+
+    first_text: Optional[float] = None  # первый текст, кроме заглушки стрима
+    text: Optional[str] = None
+    edits: int = 0
+
+
+class BenchBot:
+    """
+    Вместо telegram.Bot без сети: методы, которые вызывают обработчики,
+    запоминают отправленный текст и время первого ответа.
+    """
+
+    def __init__(self):
+        self.replies: Dict[int, Reply] = {}
+        self._message_ids = 0
+
+    def _record(self, chat_id: int, text: str):
+        reply = self.replies.setdefault(chat_id, Reply())
+        if reply.first_text is None and text != BotHandlers.STREAM_PLACEHOLDER:
+            reply.first_text = time.perf_counter()
+        reply.text = text
+
+    def _message(self, chat_id: int, text: str) -> Message:
+        self._message_ids += 1
+        message = Message(
+            self._message_ids,
+            datetime.datetime.now(datetime.timezone.utc),
+            Chat(chat_id, Chat.PRIVATE),
+            text=text,
+        )
+        message.set_bot(self)
+        return message
+
+    async def send_message(self, chat_id, text, **_kwargs):
+        self._record(chat_id, text)
+        return self._message(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, **_kwargs):
+        self._record(chat_id, text)
+        self.replies[chat_id].edits += 1
+        return True
+
+    async def delete_message(self, **_kwargs):
+        return True
+
+    async def send_chat_action(self, **_kwargs):
+        return True
+
+
+def make_update(bot: BenchBot, n: int, user_id: int, text: str) -> Update:
+    """Каждый Update в своём чате: так ответы не путаются, очередь - по user_id"""
+    message = Message(
+        n,
+        datetime.datetime.now(datetime.timezone.utc),
+        Chat(n, Chat.PRIVATE),
+        from_user=User(user_id, f"user{user_id}", False, username=f"user{user_id}"),
+        text=text,
+    )
+    message.set_bot(bot)
+    return Update(n, message=message)
+
+
+@dataclass
+class LoadResult:
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    first_reply: List[float] = field(default_factory=list)
+    outcomes: Dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+
+def outcome(reply: Optional[Reply]) -> str:
+    if reply is None:
+        return "merged"  # склеено с предыдущим сообщением пользователя
+    if reply.text == BotHandlers.BUSY_MESSAGE:
+        return "busy"
+    if reply.text == REFUSAL_MESSAGE:
+        return "refused"
+    if reply.text.startswith("Извините"):
+        return "error"
+    return "ok"
+
+
+def make_yandex_bot(
+    args: argparse.Namespace, stub: StubYandexApi, metrics: Metrics
+) -> YandexGPTBot:
+    private_key = ""
+    if args.private_key:
+        with open(args.private_key, encoding="utf-8") as f:
+            private_key = f.read()
+    config = YandexGPTConfig(
+        "bench-account",
+        "bench-key",
+        private_key,
+        "bench-folder",
+        completion_url=stub.completion_url,
+        iam_url=stub.iam_url,
+    )
+    return YandexGPTBot(
+        config,
+        speculative=args.speculative,
+        validation_batch=BatchConfig(args.validation_window, args.validation_batch),
+        token_provider=(
+            IamTokenProvider(config) if private_key else StaticTokenProvider()
+        ),
+        metrics=metrics,
+    )
+
+
+def make_handlers(
+    args: argparse.Namespace, yandex_bot: YandexGPTBot, vector_store: VectorStore
+) -> BotHandlers:
+    return BotHandlers(
+        yandex_bot,
+        vector_store,
+        stream_replies=args.stream,
+        scheduler=RequestScheduler(
+            SchedulerConfig(
+                max_concurrent=args.max_concurrent,
+                rps=args.api_rps,
+                max_wait=args.max_wait,
+            )
+        ),
+    )
+
+
+async def drive(args: argparse.Namespace, handlers: BotHandlers) -> LoadResult:
+    """Подать args.count Update с частотой args.rate и собрать результаты"""
+    bot = BenchBot()
+    rng = random.Random(args.seed)
+    result = LoadResult()
+    started = time.perf_counter()
+
+    async def one(n: int, kind: str, text: str):
+        update = make_update(bot, n, rng.randrange(args.users), text)
+        context = SimpleNamespace(bot=bot, args=text.split())
+        sent = time.perf_counter()
+        if kind == "rag":
+            await handlers.rag_command(update, context)
+        else:
+            await handlers.handle_message(update, context)
+        reply = bot.replies.get(n)
+        name = outcome(reply)
+        result.outcomes[name] = result.outcomes.get(name, 0) + 1
+        if name == "ok":
+            elapsed = time.perf_counter() - sent
+            result.latencies.setdefault(kind, []).append(elapsed)
+            result.first_reply.append(reply.first_text - sent)
+
+    tasks = []
+    next_at = started
+    questions = synthetic_queries(args.count, seed=args.seed)
+    for n, text in enumerate(questions, start=1):
+        # открытая модель: новые Update приходят независимо от ответов
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        kind = "rag" if rng.random() < args.rag_share else "chat"
+        tasks.append(asyncio.create_task(one(n, kind, text)))
+        gap = 1 / args.rate
+        next_at += rng.expovariate(args.rate) if args.poisson else gap
+    await asyncio.gather(*tasks)
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def run_load(
+    args: argparse.Namespace, stub: StubYandexApi, metrics: Metrics
+) -> LoadResult:
+    yandex_bot = make_yandex_bot(args, stub, metrics)
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_store = VectorStore(tmp, embedder=HashEmbedder(), metrics=metrics)
+        vector_store.build(synthetic_chunks(args.corpus))
+        result = await drive(args, make_handlers(args, yandex_bot, vector_store))
+
+    # свёртка истории в фоне ещё может ходить в API - до закрытия клиента
+    await yandex_bot.history.close()
+    await yandex_bot.token_provider.close()
+    await SharedHttpClient.close()
+    return result
+
+
+async def main(args: argparse.Namespace):
+    # до создания ботов: их basicConfig(INFO) тогда ничего не меняет
+    logging.basicConfig(level=args.log_level)
+    SharedHttpClient.configure(
+        HttpClientConfig(max_connections=args.pool, max_retries=args.retries)
+    )
+    stub = StubYandexApi(stub_config(args))
+    await stub.start()
+    metrics = Metrics()
+    try:
+        result = await run_load(args, stub, metrics)
+    finally:
+        await stub.close()
+
+    all_ok = [t for samples in result.latencies.values() for t in samples]
+    rows = [{"case": "all", **summarize(all_ok, result.elapsed)}]
+    for kind, samples in sorted(result.latencies.items()):
+        rows.append({"case": kind, **summarize(samples, result.elapsed)})
+    rows.append({"case": "first_reply", **summarize(result.first_reply)})
+    # разбивка по стадиям из тех же метрик, что отдаёт /metrics бота
+    for (stage,), (count, total) in sorted(metrics.stage_seconds.snapshot().items()):
+        rows.append(
+            {"case": f"stage/{stage}", "count": count, "mean_ms": total / count * 1000}
+        )
+    rows[0].update(
+        outcomes=result.outcomes,
+        api_requests=dict(stub.stats.requests),
+        api_errors=stub.stats.errors,
+        peak_rss_mb=peak_rss_mb(),
+    )
+    print_table(rows)
+    write_report("load", vars(args), rows, args.output)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=10.0, help="Update в секунду")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rag-share", type=float, default=0.3)
+    parser.add_argument("--poisson", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument(
+        "--validation-window", type=float, default=0.0, help="окно пачки, секунды"
+    )
+    parser.add_argument("--validation-batch", type=int, default=16)
+    parser.add_argument("--corpus", type=int, default=1000, help="чанков в индексе")
+    parser.add_argument("--max-concurrent", type=int, default=8)
+    parser.add_argument("--api-rps", type=float, default=0.0)
+    parser.add_argument("--max-wait", type=float, default=20.0)
+    parser.add_argument("--pool", type=int, default=100)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument(
+        "--private-key",
+        default="",
+        help="файл PEM-ключа: токен через IAM заглушки, иначе статический",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default="-", help="файл JSON, '-' - stdout")
+    add_stub_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
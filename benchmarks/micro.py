@@ -0,0 +1,129 @@
+"""
+Микробенчмарки RAG: chunk_text, VectorStore.build, открытие индекса и
+VectorStore.query на синтетическом корпусе заданного размера (в чанках).
+
+    python -m benchmarks.micro --sizes 1000,10000,100000,1000000 --index hnsw
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from common.tokens import estimate_token_counts
+from rag.faiss_index import IndexConfig
+from rag.ingest import chunk_text, get_token_counter
+from rag.rag import StoreConfig, VectorStore
+
+from .corpus import (
+    HashEmbedder,
+    synthetic_chunks,
+    synthetic_document,
+    synthetic_queries,
+)
+from .report import peak_rss_mb, print_table, summarize, write_report
+
+BATCH = 10000
+
+
+def bench_chunk_text(size: int, args: argparse.Namespace) -> Dict:
+    count = get_token_counter() if args.tokenizer == "model" else estimate_token_counts
+    text = synthetic_document(size)
+    started = time.perf_counter()
+    chunks = chunk_text(text, count=count)
+    elapsed = time.perf_counter() - started
+    return {
+        "case": f"chunk_text/{size}",
+        "seconds": elapsed,
+        "chunks": len(chunks),
+        "throughput": len(chunks) / elapsed,
+        "mb_per_s": len(text.encode("utf-8")) / 2**20 / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_store(size: int, args: argparse.Namespace) -> List[Dict]:
+    embedder = HashEmbedder()
+    config = StoreConfig(index=IndexConfig(index_type=args.index))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = VectorStore(tmp, config, embedder)
+        started = time.perf_counter()
+        # пачками, как prepare_index: корпус целиком в память не помещается
+        for start in range(0, size, BATCH):
+            store.add(synthetic_chunks(min(BATCH, size - start), start=start))
+        store.persist()
+        elapsed = time.perf_counter() - started
+        files_mb = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        rows.append(
+            {
+                "case": f"build/{size}",
+                "seconds": elapsed,
+                "throughput": size / elapsed,
+                "files_mb": files_mb / 2**20,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+        del store
+
+        started = time.perf_counter()
+        store = VectorStore(tmp, config, embedder, read_only=True)
+        rows.append(
+            {
+                "case": f"open/{size}",
+                "seconds": time.perf_counter() - started,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+
+        # разные запросы: кэши выдачи и эмбеддингов не срабатывают
+        samples = []
+        started = time.perf_counter()
+        for query in synthetic_queries(args.queries):
+            t0 = time.perf_counter()
+            store.query(query, top_k=8)
+            samples.append(time.perf_counter() - t0)
+        rows.append(
+            {
+                "case": f"query/{size}",
+                **summarize(samples, time.perf_counter() - started),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+    return rows
+
+
+def main(args: argparse.Namespace):
+    logging.basicConfig(level=args.log_level)
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    rows = []
+    # по возрастанию: пик RSS процесса тогда относится к последнему случаю
+    for size in sizes:
+        if "chunk_text" in args.cases:
+            rows.append(bench_chunk_text(size, args))
+        if "store" in args.cases:
+            rows.extend(bench_store(size, args))
+    print_table(rows)
+    write_report("micro", vars(args), rows, args.output)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--cases", default="chunk_text,store")
+    parser.add_argument("--index", default="flat", help="flat | hnsw | ivfpq")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--tokenizer",
+        default="model",
+        help="model - токенизатор эмбеддера, estimate - оценка по длине",
+    )
+    parser.add_argument("--output", default="-", help="файл JSON, '-' - stdout")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
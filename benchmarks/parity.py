@@ -0,0 +1,70 @@
+"""
+Сверка бэкендов эмбеддингов на фиксированном наборе текстов: косинусная
+близость onnx к torch и совпадение top-k соседей. Собранный индекс не нужен,
+модели берутся из кэша Hugging Face.
+
+    python -m benchmarks.parity --threshold-cos 0.95 --threshold-overlap 0.9
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+from rag.embedding import EmbedderConfig, OnnxEmbedder, TorchEmbedder, check_parity
+
+# короткие и длинные, русские и английские, с кодом и числами:
+# усечение по max_seq_length тоже должно совпадать
+PARITY_TEXTS = (
+    "Как объявить функцию в Julia?",
+    "Функции в Julia объявляются ключевым словом function или в одну строку.",
+    "Множественная диспетчеризация выбирает метод по типам всех аргументов.",
+    "Макросы раскрываются до компиляции и получают выражения, а не значения.",
+    "Массивы в Julia индексируются с единицы, срезы по умолчанию копируют данные.",
+    "Пакеты ставятся через Pkg: ] add DataFrames",
+    "Тип Union{Nothing, Int} описывает значение, которого может не быть.",
+    "Broadcasting: точка перед оператором, например a .+ b, применяет его поэлементно.",
+    "Замыкания захватывают переменные по ссылке, а не по значению.",
+    "Модуль Base.Threads даёт @threads и @spawn для параллельных вычислений.",
+    "How do I read a CSV file into a DataFrame?",
+    "The garbage collector in Julia is generational and non-moving.",
+    "Type instability makes the compiler fall back to dynamic dispatch.",
+    "function f(x::Int) return x^2 + 1 end",
+    "Ошибка MethodError: no method matching +(::String, ::Int64)",
+    "Погода сегодня солнечная, до +25 градусов.",
+    "1 2 3 4 5 6 7 8 9 10",
+    "ок",
+    " ".join(["Длинный абзац про производительность и аллокации в циклах."] * 60),
+    " ".join(["A long paragraph about allocations in hot loops."] * 60),
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=EmbedderConfig.model_name)
+    parser.add_argument("--onnx-file", default=EmbedderConfig.onnx_file)
+    parser.add_argument("--threshold-cos", type=float, default=0.95)
+    parser.add_argument("--threshold-overlap", type=float, default=0.9)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    report = check_parity(
+        TorchEmbedder(EmbedderConfig(model_name=args.model)),
+        OnnxEmbedder(
+            EmbedderConfig(
+                model_name=args.model, backend="onnx", onnx_file=args.onnx_file
+            )
+        ),
+        list(PARITY_TEXTS),
+    )
+    print(json.dumps(report, indent=2))
+    # квантование немного сдвигает вектора, но не должно менять соседей
+    passed = (
+        report["cos_min"] > args.threshold_cos
+        and report["topk_overlap"] > args.threshold_overlap
+    )
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# метрики, где больше - хуже (остальные числа: больше - лучше)
+LOWER_IS_BETTER = (
+    "seconds",
+    "mean_ms",
+    "p50_ms",
+    "p95_ms",
+    "p99_ms",
+    "max_ms",
+    "peak_rss_mb",
+    "files_mb",
+)
+SUMMARY_KEYS = ("p50_ms", "p95_ms", "p99_ms", "throughput")
+
+
+def summarize(samples: List[float], elapsed: Optional[float] = None) -> Dict:
+    """Перцентили латентности (мс) и пропускная способность (в секунду)"""
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]).tolist()
+    summary = {
+        "count": len(samples),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": float(ms.max()),
+    }
+    if elapsed:
+        summary["throughput"] = len(samples) / elapsed
+    return summary
+
+
+def peak_rss_mb() -> float:
+    """Пик RSS процесса с его запуска (на Linux ru_maxrss в КБ)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 if sys.platform != "darwin" else rss / 2**20
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def write_report(name: str, params: Dict, results: List[Dict], path: str = "-"):
+    """
+    JSON-отчёт: окружение, параметры запуска и по строке на случай.
+    Отчёты двух версий сравнивает benchmarks.compare.
+    """
+    report = {
+        "benchmark": name,
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path == "-":
+        print(text)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+def print_table(results: List[Dict]):
+    """Короткая сводка в stderr, чтобы stdout оставался чистым JSON"""
+    for row in results:
+        fields = [f"{row['case']:<28}"]
+        for key in ("seconds", "mean_ms", *SUMMARY_KEYS, "peak_rss_mb"):
+            if key in row:
+                fields.append(f"{key}={row[key]:.2f}")
+        print(" ".join(fields), file=sys.stderr)
@@ -0,0 +1,209 @@
+"""
+Заглушка Yandex API (IAM и completion) для нагрузочных тестов без расхода квоты.
+
+    python -m benchmarks.stub_api --port 8081 --latency 0.5 --error-rate 0.05
+
+Бот направляется на неё через YANDEX_COMPLETION_URL и YANDEX_IAM_URL.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from gpt.http_server import HttpRequest, HttpServer, send_response
+
+COMPLETION_PATH = "/foundationModels/v1/completion"
+IAM_PATH = "/iam/v1/tokens"
+
+
+@dataclass
+class StubAnswer:
+    """Что и как отвечает заглушка"""
+
+    words: int = 60
+    verdict: str = "Да"  # ответ на запросы валидатора
+    stream_chunks: int = 10  # частей потокового ответа
+    chunk_delay: float = 0.05
+
+
+@dataclass
+class StubConfig:
+    """Поведение заглушки: задержки в секундах, доля ошибок от 0 до 1"""
+
+    latency: float = 0.3  # до первого байта ответа
+    jitter: float = 0.1  # +- к latency, равномерно
+    error_rate: float = 0.0
+    error_status: int = 503
+    answer: StubAnswer = field(default_factory=StubAnswer)
+    seed: Optional[int] = None
+
+
+@dataclass
+class StubStats:
+    requests: Counter = field(default_factory=Counter)
+    errors: int = 0
+    streamed: int = 0
+
+
+class StubYandexApi:
+    """HTTP/1.1 сервер на asyncio: отвечает как completion и IAM API"""
+
+    def __init__(self, config: Optional[StubConfig] = None):
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self._rng = random.Random(self.config.seed)
+        self._http = HttpServer(self._handle)
+        self._tokens = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._http.address
+        return f"http://{host}:{port}"
+
+    @property
+    def completion_url(self) -> str:
+        return self.base_url + COMPLETION_PATH
+
+    @property
+    def iam_url(self) -> str:
+        return self.base_url + IAM_PATH
+
+    async def start(self, host="127.0.0.1", port=0):
+        await self._http.start(host, port)
+
+    async def close(self):
+        await self._http.close()
+
+    async def _handle(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        cfg = self.config
+        path = request.path
+        self.stats.requests[path] += 1
+        await asyncio.sleep(
+            max(0.0, cfg.latency + self._rng.uniform(-cfg.jitter, cfg.jitter))
+        )
+        if path not in (COMPLETION_PATH, IAM_PATH):
+            await self._send(writer, 404, {"error": "not found"})
+            return
+        if self._rng.random() < cfg.error_rate:
+            self.stats.errors += 1
+            await self._send(writer, cfg.error_status, {"error": "stub failure"})
+            return
+
+        if path == IAM_PATH:
+            self._tokens += 1
+            await self._send(writer, 200, {"iamToken": f"stub-token-{self._tokens}"})
+            return
+
+        payload = json.loads(request.body)
+        text = self._answer(payload.get("messages", []))
+        if not payload.get("completionOptions", {}).get("stream"):
+            await self._send(writer, 200, self._result(text))
+            return
+
+        self.stats.streamed += 1
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        words = text.split(" ")
+        parts = max(1, min(cfg.answer.stream_chunks, len(words)))
+        for n in range(1, parts + 1):
+            # как у Yandex: каждая строка содержит весь накопленный текст
+            partial = " ".join(words[: len(words) * n // parts])
+            line = json.dumps(self._result(partial), ensure_ascii=False) + "\n"
+            data = line.encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+            if n < parts:
+                await asyncio.sleep(cfg.answer.chunk_delay)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _answer(self, messages: List[Dict]) -> str:
+        system = messages[0]["text"] if messages else ""
+        if "фильтр безопасности" in system:
+            if "JSON" in system:
+                # пачка валидатора: вердикт на каждый тег сообщения
+                tags = re.findall(r"<msg-(\d+)-", messages[-1]["text"])
+                verdicts = {n: self.config.answer.verdict for n in tags}
+                return json.dumps(verdicts, ensure_ascii=False)
+            return self.config.answer.verdict
+        words = ("дорогуша", "Julia", "варенье", "оператор", "функция", "чай")
+        return " ".join(
+            self._rng.choice(words) for _ in range(self.config.answer.words)
+        )
+
+    @staticmethod
+    def _result(text: str) -> Dict:
+        return {
+            "result": {
+                "alternatives": [
+                    {
+                        "message": {"role": "assistant", "text": text},
+                        "status": "ALTERNATIVE_STATUS_FINAL",
+                    }
+                ],
+                "usage": {"inputTextTokens": "0", "completionTokens": "0"},
+                "modelVersion": "stub",
+            }
+        }
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: int, payload: Dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await send_response(writer, status, data)
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--stream-chunks", type=int, default=10)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    parser.add_argument("--verdict", default="Да")
+
+
+def stub_config(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        answer=StubAnswer(
+            verdict=args.verdict,
+            stream_chunks=args.stream_chunks,
+            chunk_delay=args.chunk_delay,
+        ),
+    )
+
+
+async def _serve_forever(args: argparse.Namespace):
+    stub = StubYandexApi(stub_config(args))
+    await stub.start(args.host, args.port)
+    print(f"YANDEX_COMPLETION_URL={stub.completion_url}")
+    print(f"YANDEX_IAM_URL={stub.iam_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_stub_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_serve_forever(parse_args()))
+    except KeyboardInterrupt:
+        pass
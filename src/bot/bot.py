@@ -1,17 +1,62 @@
 import logging
+import time
+from typing import AsyncIterator, Optional
 
-from telegram import Update
+from telegram import Message, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
-from src.rag import rag
+from rag import rag
+
+from .scheduler import Job, RequestScheduler, SchedulerBusy
 
 logger = logging.getLogger(__name__)
 
 
 class BotHandlers:
-    def __init__(self, yandex_bot, vector_store):
+    # Telegram ограничивает частоту правок сообщения, правим не чаще раза в секунду
+    STREAM_EDIT_INTERVAL = 1.0
+    STREAM_PLACEHOLDER = "✍️ ..."
+    BUSY_MESSAGE = "⏳ Сейчас слишком много запросов. Попробуйте через минуту."
+
+    def __init__(
+        self,
+        yandex_bot,
+        vector_store,
+        stream_replies: bool = False,
+        answer_cache=None,
+        scheduler: Optional[RequestScheduler] = None,
+    ):
         self.yandex_bot = yandex_bot
         self.vector_store = vector_store
+        self.stream_replies = stream_replies
+        self.answer_cache = answer_cache
+        self.scheduler = scheduler or RequestScheduler()
+        # один реестр метрик на бота, валидатор и индекс
+        self.metrics = yandex_bot.metrics
+        self._register_gauges()
+
+    def _register_gauges(self):
+        """Очередь и кэши читаются в момент запроса /metrics"""
+        for key in self.scheduler.metrics():
+            self.metrics.gauge(
+                f"scheduler_{key}",
+                "Очередь запросов к API",
+                lambda key=key: self.scheduler.metrics()[key],
+            )
+        for key in ("embedding_hit_rate", "result_hit_rate", "generation"):
+            # vector_store читается каждый раз: индекс может быть подменён
+            self.metrics.gauge(
+                f"rag_{key}",
+                "Кэши и поколение индекса",
+                lambda key=key: self.vector_store.cache_stats()[key],
+            )
+        if self.answer_cache is not None:
+            self.metrics.gauge(
+                "rag_answer_hit_rate",
+                "Доля ответов /rag из кэша",
+                lambda: self.answer_cache.hit_rate,
+            )
 
     async def start(self, update: Update, _context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -38,7 +83,7 @@ class BotHandlers:
     ):
         """Показать информацию об истории диалога"""
         user_id = update.effective_user.id
-        history = self.yandex_bot.get_user_history(user_id)
+        history = await self.yandex_bot.get_user_history(user_id)
 
         if not history:
             await update.message.reply_text("📭 История диалога пуста")
@@ -65,17 +110,44 @@ class BotHandlers:
             return
 
         try:
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id, action="typing"
+            job = self.scheduler.submit(
+                update.effective_user.id, user_message, kind="rag"
             )
+            if job is None:
+                # вопрос дописан к ещё не начатому запросу, ответ будет там
+                return
 
-            response = rag.rag_answer(
-                self.vector_store,
-                self.yandex_bot,
-                user_message,
-                update.effective_user.id,
-            )
-            await update.message.reply_text(response)
+            with self.metrics.trace("rag"):
+                await self._send_typing(update, context, job)
+
+                async with self.scheduler.slot(job):
+                    self.metrics.observe("queue", time.monotonic() - job.created)
+                    if self.stream_replies:
+                        await self._reply_streaming(
+                            update,
+                            rag.rag_answer_stream(
+                                self.vector_store,
+                                self.yandex_bot,
+                                job.text,
+                                update.effective_user.id,
+                                self.answer_cache,
+                            ),
+                        )
+                        return
+
+                    response = await rag.rag_answer(
+                        self.vector_store,
+                        self.yandex_bot,
+                        job.text,
+                        update.effective_user.id,
+                        self.answer_cache,
+                    )
+                with self.metrics.span("reply"):
+                    await update.message.reply_text(response)
+
+        except SchedulerBusy as e:
+            logger.warning("/rag request shed: %s", e)
+            await update.message.reply_text(self.BUSY_MESSAGE)
 
         except Exception as e:
             logger.error("Error handling /rag command: %s", str(e))
@@ -102,12 +174,29 @@ class BotHandlers:
                 user_message[:50],
             )
 
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id, action="typing"
-            )
+            job = self.scheduler.submit(user_id, user_message)
+            if job is None:
+                logger.info("Message from %s merged into queued request", username)
+                return
 
-            response = self.yandex_bot.ask_gpt(user_message, user_id)
-            await update.message.reply_text(response)
+            with self.metrics.trace("chat"):
+                await self._send_typing(update, context, job)
+
+                async with self.scheduler.slot(job):
+                    self.metrics.observe("queue", time.monotonic() - job.created)
+                    if self.stream_replies:
+                        await self._reply_streaming(
+                            update, self.yandex_bot.ask_gpt_stream(job.text, user_id)
+                        )
+                        return
+
+                    response = await self.yandex_bot.ask_gpt(job.text, user_id)
+                with self.metrics.span("reply"):
+                    await update.message.reply_text(response)
+
+        except SchedulerBusy as e:
+            logger.warning("Request from %s shed: %s", username, e)
+            await update.message.reply_text(self.BUSY_MESSAGE)
 
         except Exception as e:
             logger.error("Error handling message from %s: %s", username, str(e))
@@ -116,6 +205,51 @@ class BotHandlers:
                 "Пожалуйста, попробуйте позже."
             )
 
+    async def _send_typing(
+        self, update: Update, context: ContextTypes.DEFAULT_TYPE, job: Job
+    ):
+        """Статус "печатает" до входа в slot(): при ошибке или отмене слот возвращается"""
+        try:
+            with self.metrics.span("telegram_action"):
+                await context.bot.send_chat_action(
+                    chat_id=update.effective_chat.id, action="typing"
+                )
+        except BaseException:
+            self.scheduler.cancel(job)
+            raise
+
+    async def _reply_streaming(self, update: Update, partials: AsyncIterator[str]):
+        """Отправить заглушку и дописывать её по мере генерации ответа"""
+        with self.metrics.span("reply"):
+            message = await update.message.reply_text(self.STREAM_PLACEHOLDER)
+        shown = self.STREAM_PLACEHOLDER
+        text = ""
+        last_edit = 0.0
+        try:
+            async for text in partials:
+                now = time.monotonic()
+                if text and now - last_edit >= self.STREAM_EDIT_INTERVAL:
+                    with self.metrics.span("reply"):
+                        shown = await self._edit_if_changed(message, shown, text)
+                    last_edit = now
+            if text:
+                with self.metrics.span("reply"):
+                    await self._edit_if_changed(message, shown, text)
+        except Exception:
+            await message.delete()
+            raise
+
+    @staticmethod
+    async def _edit_if_changed(message: Message, shown: str, text: str) -> str:
+        if text == shown:
+            return shown
+        try:
+            await message.edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                raise
+        return text
+
     @staticmethod
     async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
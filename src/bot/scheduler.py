@@ -0,0 +1,222 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional, Set
+
+
+class SchedulerBusy(Exception):
+    """Очередь перегружена, запрос не будет выполнен"""
+
+
+@dataclass
+class SchedulerConfig:
+    """Ограничения запросов к Yandex API"""
+
+    max_concurrent: int = 8  # одновременно выполняемых запросов
+    rps: float = 5.0  # запуск запросов в секунду, 0 - без ограничения
+    burst: int = 10
+    max_wait: float = 20.0  # дольше в очереди - отвечаем "занято"
+    max_queue: int = 500
+
+
+@dataclass
+class Job:
+    user_id: int
+    kind: str
+    text: str
+    ready: asyncio.Future
+    created: float = field(default_factory=time.monotonic)
+    active: bool = False  # занимает слот: выдан _dispatch и ещё не освобождён
+
+
+@dataclass
+class SchedulerStats:
+    submitted: int = 0
+    coalesced: int = 0
+    shed: int = 0
+    started: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+
+@dataclass
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас"""
+
+    rate: float
+    burst: int
+    _tokens: float = field(init=False)
+    _refilled: float = field(init=False, default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self._tokens = float(self.burst)
+
+    def take(self) -> float:
+        """0 - токен взят, иначе сколько ждать следующего"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        elapsed = now - self._refilled
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class RequestScheduler:
+    """
+    Очередь перед API: общий лимит одновременных запросов, token bucket по RPS,
+    у каждого пользователя своя очередь и не больше одного запроса в работе,
+    пользователи обслуживаются по кругу. Сообщения, пришедшие, пока предыдущее
+    ещё ждёт в очереди, склеиваются с ним в один запрос.
+    """
+
+    def __init__(self, config: Optional[SchedulerConfig] = None):
+        self.config = config or SchedulerConfig()
+        self.stats = SchedulerStats()
+        self._queues: Dict[int, Deque[Job]] = {}
+        self._order: Deque[int] = deque()  # пользователи с ожидающими запросами
+        self._active: Set[int] = set()
+        self._bucket = TokenBucket(self.config.rps, self.config.burst)
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return len(self._active)
+
+    def submit(self, user_id: int, text: str, kind: str = "chat") -> Optional[Job]:
+        """
+        Поставить запрос в очередь. None - сообщение приклеено к ещё не
+        начатому запросу этого пользователя, отвечать на него отдельно не нужно.
+        """
+        self.stats.submitted += 1
+        queue = self._queues.get(user_id)
+        if queue and queue[-1].kind == kind:
+            queue[-1].text += "\n" + text
+            self.stats.coalesced += 1
+            return None
+        if self.queue_depth >= self.config.max_queue:
+            self.stats.shed += 1
+            raise SchedulerBusy("Очередь заполнена")
+
+        job = Job(user_id, kind, text, asyncio.get_running_loop().create_future())
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._order.append(user_id)
+        queue.append(job)
+        self._dispatch()
+        return job
+
+    @asynccontextmanager
+    async def slot(self, job: Job) -> AsyncIterator[Job]:
+        """Дождаться очереди запроса и держать слот до выхода из блока"""
+        deadline = job.created + self.config.max_wait
+        try:
+            while not job.ready.done():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 and job.user_id in self._active:
+                    # ждём собственный предыдущий запрос, а не общую очередь
+                    deadline = time.monotonic() + self.config.max_wait
+                elif timeout <= 0:
+                    self.stats.shed += 1
+                    raise SchedulerBusy(
+                        f"Ожидание в очереди дольше {self.config.max_wait}с"
+                    )
+                else:
+                    await asyncio.wait({job.ready}, timeout=timeout)
+        except BaseException:
+            self._abandon(job)
+            raise
+
+        wait = time.monotonic() - job.created
+        self.stats.wait_total += wait
+        self.stats.wait_max = max(self.stats.wait_max, wait)
+        try:
+            yield job
+        finally:
+            self._release(job)
+
+    def cancel(self, job: Job):
+        """
+        Снять запрос, в slot() которого так и не вошли: убрать из очереди
+        или вернуть уже выданный слот
+        """
+        self._abandon(job)
+
+    def metrics(self) -> Dict[str, float]:
+        started = self.stats.started
+        return {
+            "queue_depth": self.queue_depth,
+            "running": self.running,
+            "submitted": self.stats.submitted,
+            "coalesced": self.stats.coalesced,
+            "shed": self.stats.shed,
+            "wait_avg": self.stats.wait_total / started if started else 0.0,
+            "wait_max": self.stats.wait_max,
+        }
+
+    def _dispatch(self):
+        while len(self._active) < self.config.max_concurrent and self._order:
+            # первый по кругу пользователь, у которого ничего не выполняется
+            for _ in range(len(self._order)):
+                if self._order[0] not in self._active:
+                    break
+                self._order.rotate(-1)
+            else:
+                return
+            delay = self._bucket.take()
+            if delay:
+                self._wake_after(delay)
+                return
+
+            user_id = self._order.popleft()
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if queue:
+                self._order.append(user_id)
+            else:
+                del self._queues[user_id]
+            self._active.add(user_id)
+            job.active = True
+            self.stats.started += 1
+            job.ready.set_result(None)
+
+    def _wake_after(self, delay: float):
+        if self._timer is not None:
+            return
+
+        def wake():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, wake)
+
+    def _release(self, job: Job):
+        if not job.active:
+            return
+        job.active = False
+        self._active.discard(job.user_id)
+        self._dispatch()
+
+    def _abandon(self, job: Job):
+        if job.active:
+            # слот успели выдать - возвращаем
+            self._release(job)
+            return
+        if job.ready.done():
+            return
+        job.ready.cancel()
+        queue = self._queues.get(job.user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.user_id]
+                self._order.remove(job.user_id)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Dict, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# принятых, но ещё не начатых Update; дальше PTB держит их в своей очереди
+MAX_PENDING_UPDATES = 10000
+
+
+@dataclass
+class _ChatTurn:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    waiting: int = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка Update: одновременно выполняется не больше
+    max_running, а Update одного чата - строго по очереди прихода.
+    Ждущий своей очереди в чате Update слот не занимает, поэтому
+    один активный чат не задерживает остальных.
+    """
+
+    def __init__(
+        self, max_running: int, ordered: bool = True, drain_timeout: float = 25.0
+    ):
+        # семафор базового класса ограничивает принятые Update, свой - выполняемые
+        super().__init__(MAX_PENDING_UPDATES)
+        self.max_running = max_running
+        self.ordered = ordered
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_running)
+        self._chats: Dict[int, _ChatTurn] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._aborted = False
+
+    @property
+    def running(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def pending(self) -> int:
+        return self.current_concurrent_updates - self.running
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        chat_id = self._chat_id(update) if self.ordered else None
+        if chat_id is None:
+            await self._run(coroutine)
+            return
+
+        turn = self._chats.setdefault(chat_id, _ChatTurn())
+        turn.waiting += 1
+        try:
+            async with turn.lock:
+                await self._run(coroutine)
+        finally:
+            turn.waiting -= 1
+            if not turn.waiting:
+                del self._chats[chat_id]
+
+    async def _run(self, coroutine: Awaitable[Any]):
+        async with self._slots:
+            if self._aborted:
+                # время на остановку вышло, оставшиеся Update не начинаем
+                coroutine.close()
+                return
+            task = asyncio.current_task()
+            self._tasks.add(task)
+            try:
+                await coroutine
+            finally:
+                self._tasks.discard(task)
+
+    def abort(self):
+        """Отменить выполняющиеся Update и не начинать новые"""
+        self._aborted = True
+        if self._tasks:
+            logger.warning("Drain timeout: cancelling %d updates", len(self._tasks))
+        for task in self._tasks:
+            task.cancel()
+
+    async def initialize(self):
+        self._aborted = False
+
+    async def shutdown(self):
+        """Ресурсов нет, дообработку ограничивает DrainingApplication.stop"""
+
+
+class DrainingApplication(Application):
+    """
+    Application.stop уже дожидается всех принятых Update; здесь ожидание
+    ограничено drain_timeout процессора, чтобы остановка укладывалась
+    в отведённое оркестратором время.
+    """
+
+    async def stop(self):
+        processor = self.update_processor
+        if not isinstance(processor, ChatOrderedUpdateProcessor):
+            await super().stop()
+            return
+        timer = asyncio.get_running_loop().call_later(
+            processor.drain_timeout, processor.abort
+        )
+        try:
+            await super().stop()
+        finally:
+            timer.cancel()
@@ -0,0 +1,27 @@
+"""
+Офлайн-сборка индекса: python src/build_index.py (cron, CI, отдельный контейнер).
+Бот подхватит новую версию из RAG_INDEX_DIR без перезапуска.
+"""
+
+import logging
+import sys
+
+from rag_settings import RAG_INDEX_DIR, build_index
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def main() -> int:
+    version = build_index()
+    if version is None:
+        logger.info("Бакет не изменился, версия индекса прежняя")
+    else:
+        logger.info("Собрана версия %s в %s", version, RAG_INDEX_DIR)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def normalize_query(text: str) -> str:
+    """Регистр и пробелы не меняют смысл запроса (MiniLM всё равно uncased)"""
+    return " ".join(text.casefold().split())
+
+
+class LRUCache:
+    """Потокобезопасный LRU с необязательным TTL и счётчиками попаданий"""
+
+    blocking = False
+
+    def __init__(self, max_size=1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl and time.time() - item[1] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SqliteCache:
+    """
+    Тот же интерфейс get/put, но в SQLite-файле: переживает перезапуски и
+    общий для нескольких процессов. Вызовы блокирующие (AsyncCache выполняет
+    их в потоке); отметки использования копятся в памяти и пишутся пачкой
+    со следующей записью, вытеснение - не чаще раза в prune_interval секунд.
+    """
+
+    blocking = True
+
+    # столько отметок использования ждут записи, потом пишутся без put
+    MAX_TOUCHED = 256
+
+    def __init__(
+        self,
+        path: str,
+        max_size=10000,
+        ttl: Optional[float] = None,
+        prune_interval: float = 60.0,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}  # key -> время последнего чтения
+        self._pruned = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        oldest = now - self.ttl if self.ttl else 0
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND created > ?",
+                (key, oldest),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.MAX_TOUCHED:
+                self._write_touched()
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created, used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._touched.pop(key, None)
+            self._write_touched()
+            if now - self._pruned >= self.prune_interval:
+                self._prune(now)
+            self._conn.commit()
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE cache SET used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _prune(self, now: float):
+        self._pruned = now
+        if self.ttl:
+            self._conn.execute(
+                "DELETE FROM cache WHERE created <= ?", (now - self.ttl,)
+            )
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class AsyncCache:
+    """
+    LRUCache или SqliteCache для кода в event loop: дисковый бэкенд
+    вызывается в потоке, попадания считаются для метрик.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def _call(self, method, *args):
+        if getattr(self.backend, "blocking", False):
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self._call(self.backend.get, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, key: str, value: Any):
+        await self._call(self.backend.put, key, value)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
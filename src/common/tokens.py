@@ -0,0 +1,11 @@
+from typing import List
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (~3 символа на токен для русского текста)"""
+    return len(text) // 3 + 1
+
+
+def estimate_token_counts(texts: List[str]) -> List[int]:
+    """estimate_tokens для пачки текстов, когда токенизатора модели нет"""
+    return [estimate_tokens(t) for t in texts]
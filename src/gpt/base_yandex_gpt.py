@@ -1,12 +1,17 @@
+import json
 import logging
 import time
 from dataclasses import dataclass
-from typing import Dict, List
-
-import jwt
-import requests
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
+from .client import SharedHttpClient
 from .exceptions import YandexGptException
+from .history import HistoryConfig, HistoryManager
+from .iam import IAM_URL, IamTokenProvider, TokenProvider
+from .metrics import Metrics
+from .storage import HistoryStore, Message
+
+COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
 
 
 @dataclass
@@ -17,29 +22,46 @@ class YandexGPTConfig:
     key_id: str
     private_key: str
     folder_id: str
+    # адреса API можно подменить локальной заглушкой (benchmarks/stub_api.py)
+    completion_url: str = COMPLETION_URL
+    iam_url: str = IAM_URL
 
 
-@dataclass
-class Message:
-    """Сообщение в истории диалога"""
-
-    role: str  # "user" или "assistant"
-    text: str
+SUMMARY_PROMPT = Message(
+    role="system",
+    text=(
+        "Ты ведёшь краткий конспект диалога. Объедини предыдущий конспект и "
+        "новые реплики в один связный конспект на русском языке: факты о "
+        "собеседнике, его вопросы и данные ответы. Не больше 150 слов, "
+        "без вступлений и пояснений."
+    ),
+)
 
 
 class BaseYandexGPTBot:
-    def __init__(self, config: YandexGPTConfig):
+    # метка в метриках: чей запрос к API
+    metrics_caller = "chat"
+
+    def __init__(
+        self,
+        config: YandexGPTConfig,
+        history_config: Optional[HistoryConfig] = None,
+        history_store: Optional[HistoryStore] = None,
+        token_provider: Optional[TokenProvider] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         logging.basicConfig(
             format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
             level=logging.INFO,
         )
         self.logger = logging.getLogger(__name__)
 
-        self.iam_token = None
         self.config = config
-
-        self.token_expires = 0
-        self.user_histories: Dict[int, List[Message]] = {}
+        self.token_provider = token_provider or IamTokenProvider(config)
+        self.metrics = metrics or Metrics()
+        self.history = HistoryManager(
+            history_config, summarizer=self._summarize, store=history_store
+        )
 
         self.system_prompt = Message(
             role="system",
@@ -88,121 +110,187 @@ class BaseYandexGPTBot:
             ),
         )
 
-    def get_user_history(self, user_id: int) -> List[Message]:
+    async def get_user_history(self, user_id: int) -> List[Message]:
         """Получить историю для конкретного пользователя"""
-        if user_id not in self.user_histories:
-            self.user_histories[user_id] = []
-        return self.user_histories[user_id]
+        return await self.history.messages(user_id)
 
     def add_to_history(self, user_id: int, role: str, text: str):
         """Добавить сообщение в историю пользователя"""
-        history = self.get_user_history(user_id)
-        history.append(Message(role=role, text=text))
+        self.history.add(user_id, role, text)
 
     def clear_history(self, user_id: int):
         """Очистить историю пользователя"""
-        if user_id in self.user_histories:
-            self.user_histories[user_id] = []
+        if self.history.clear(user_id):
             self.logger.info("History cleared for user %s.", user_id)
 
-    def get_iam_token(self):
-        """Получение IAM-токена (с кэшированием на 1 час)"""
-        if self.iam_token and time.time() < self.token_expires:
-            return self.iam_token
+    @property
+    def model_uri(self) -> str:
+        return f"gpt://{self.config.folder_id}/yandexgpt-lite"
 
-        try:
-            now = int(time.time())
-            payload = {
-                "aud": "https://iam.api.cloud.yandex.net/iam/v1/tokens",
-                "iss": self.config.service_account_id,
-                "iat": now,
-                "exp": now + 360,
-            }
-
-            encoded_token = jwt.encode(
-                payload,
-                self.config.private_key,
-                algorithm="PS256",
-                headers={"kid": self.config.key_id},
-            )
+    async def get_iam_token(self) -> str:
+        """IAM-токен из общего провайдера (обновляется заранее в фоне)"""
+        with self.metrics.span("iam"):
+            return await self.token_provider.get_token()
 
-            response = requests.post(
-                "https://iam.api.cloud.yandex.net/iam/v1/tokens",
-                json={"jwt": encoded_token},
-                timeout=10,
-            )
+    async def unsafe_ask_gpt(self, question: str, user_id: int = None):
+        """Запрос к Yandex GPT API с учетом истории пользователя"""
+        answer = await self._complete(question, user_id)
+        self._commit_answer(question, answer, user_id)
+        return answer
+
+    async def unsafe_ask_gpt_stream(
+        self, question: str, user_id: int = None
+    ) -> AsyncIterator[str]:
+        """Потоковый запрос: отдаёт накопленный текст ответа по мере генерации"""
+        answer = ""
+        async for answer in self._stream_complete(question, user_id):
+            yield answer
+        self._commit_answer(question, answer, user_id)
+
+    async def _completion_request(
+        self, question: str, user_id: int = None, stream: bool = False
+    ) -> Tuple[Dict, Dict]:
+        """Заголовки и тело запроса к completion API"""
+        system_text = self.system_prompt.text
+        messages = []
+
+        if user_id is not None:
+            summary, history = await self.history.context(user_id)
+            if summary:
+                system_text += f"\n\nКраткое содержание разговора ранее:\n{summary}"
+            messages.extend(history)
+
+        messages.insert(0, Message(role=self.system_prompt.role, text=system_text))
+        messages.append(Message(role="user", text=question))
+        return await self._request_body(messages, stream=stream)
+
+    async def _request_body(
+        self, messages: List[Message], stream: bool = False, temperature: float = 0.99
+    ) -> Tuple[Dict, Dict]:
+        iam_token = await self.get_iam_token()
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {iam_token}",
+            "x-folder-id": self.config.folder_id,
+        }
+
+        data = {
+            "modelUri": self.model_uri,
+            "completionOptions": {
+                "stream": stream,
+                "temperature": temperature,
+                "maxTokens": 2000,
+            },
+            "messages": [{"role": msg.role, "text": msg.text} for msg in messages],
+        }
+        return headers, data
+
+    async def _summarize(self, summary: str, messages: List[Message]) -> str:
+        """Свернуть старые реплики в конспект (вызывается HistoryManager)"""
+        transcript = "\n".join(f"{msg.role}: {msg.text}" for msg in messages)
+        headers, data = await self._request_body(
+            [
+                SUMMARY_PROMPT,
+                Message(
+                    role="user",
+                    text=f"Предыдущий конспект:\n{summary}\n\nНовые реплики:\n{transcript}",
+                ),
+            ],
+            temperature=0.3,
+        )
 
-            if response.status_code != 200:
-                raise YandexGptException(f"Ошибка генерации токена: {response.text}")
+        payload = await self._post_completion("summary", headers, data)
+        self.logger.info("History of %d messages summarized", len(messages))
+        return payload["result"]["alternatives"][0]["message"]["text"]
 
-            token_data = response.json()
-            self.iam_token = token_data["iamToken"]
-            self.token_expires = now + 3500
+    async def _complete(self, question: str, user_id: int = None) -> str:
+        """Запрос к Yandex GPT API без записи в историю"""
+        try:
+            headers, data = await self._completion_request(question, user_id)
 
-            self.logger.info("IAM token generated successfully")
-            return self.iam_token
+            payload = await self._post_completion(self.metrics_caller, headers, data)
+            return payload["result"]["alternatives"][0]["message"]["text"]
 
         except Exception as e:
-            self.logger.error("Error generating IAM token: %s", str(e))
+            self.logger.error("Error in ask_gpt: %s", str(e))
             raise
 
-    def unsafe_ask_gpt(self, question: str, user_id: int = None):
-        """Запрос к Yandex GPT API с учетом истории пользователя"""
+    async def _stream_complete(
+        self, question: str, user_id: int = None
+    ) -> AsyncIterator[str]:
+        """Потоковый запрос без записи в историю"""
         try:
-            iam_token = self.get_iam_token()
-
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {iam_token}",
-                "x-folder-id": self.config.folder_id,
-            }
-
-            messages = [
-                {"role": self.system_prompt.role, "text": self.system_prompt.text}
-            ]
-
-            if user_id is not None:
-                history = self.get_user_history(user_id)
-                for msg in history:
-                    messages.append({"role": msg.role, "text": msg.text})
-
-            messages.append({"role": "user", "text": question})
-
-            data = {
-                "modelUri": f"gpt://{self.config.folder_id}/yandexgpt-lite",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.99,
-                    "maxTokens": 2000,
-                },
-                "messages": messages,
-            }
-
-            response = requests.post(
-                "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-                headers=headers,
-                json=data,
-                timeout=30,
+            headers, data = await self._completion_request(
+                question, user_id, stream=True
             )
 
-            if response.status_code != 200:
-                self.logger.error("Yandex GPT API error: %s", response.text)
-                raise YandexGptException(f"Ошибка API: {response.status_code}")
-
-            answer = response.json()["result"]["alternatives"][0]["message"]["text"]
-
-            if user_id is not None:
-                self.add_to_history(user_id, "user", question)
-                self.add_to_history(user_id, "assistant", answer)
-
-            self.logger.info(
-                "dialog info for user %s:\nquestion: %s\nanswer: %s",
-                user_id if user_id else "unknown",
-                question[: min(100, len(question))],
-                answer[: min(len(answer), 100)],
-            )
-            return answer
+            stage = f"{self.metrics_caller}_completion"
+            started = time.perf_counter()
+            async with SharedHttpClient.stream_post(
+                self.config.completion_url, headers=headers, json=data, timeout=30
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    self._record_response(self.metrics_caller, response)
+                    self.logger.error("Yandex GPT API error: %s", response.text)
+                    raise YandexGptException(f"Ошибка API: {response.status_code}")
+
+                # каждая строка - JSON с уже накопленным текстом ответа
+                size, payload = 0, {}
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    if not size:
+                        self.metrics.observe(
+                            f"{stage}_first_chunk", time.perf_counter() - started
+                        )
+                    size += len(line)
+                    payload = json.loads(line)
+                    yield payload["result"]["alternatives"][0]["message"]["text"]
+
+            # usage - в последней строке; время включает отправку частей в Telegram
+            self.metrics.api.record(self.metrics_caller, 200, payload, size)
+            self.metrics.observe(f"{stage}_stream", time.perf_counter() - started)
 
         except Exception as e:
-            self.logger.error("Error in ask_gpt: %s", str(e))
+            self.logger.error("Error in ask_gpt_stream: %s", str(e))
             raise
+
+    async def _post_completion(
+        self, caller: str, headers: Dict, data: Dict, stage: str = ""
+    ) -> Dict:
+        """Непотоковый запрос к completion API; возвращает JSON ответа"""
+        with self.metrics.span(stage or f"{caller}_completion"):
+            response = await SharedHttpClient.post(
+                self.config.completion_url, headers=headers, json=data, timeout=30
+            )
+        payload = self._record_response(caller, response)
+        if response.status_code != 200:
+            self.logger.error("Yandex GPT API error: %s", response.text)
+            raise YandexGptException(f"Ошибка API: {response.status_code}")
+        return payload
+
+    def _record_response(self, caller: str, response) -> Dict:
+        """Счётчики статуса, байт и токенов ответа; возвращает его JSON"""
+        try:
+            payload = response.json() if response.status_code == 200 else {}
+        except ValueError:
+            payload = {}
+        self.metrics.api.record(
+            caller, response.status_code, payload, len(response.content)
+        )
+        return payload
+
+    def _commit_answer(self, question: str, answer: str, user_id: int = None):
+        """Записать вопрос и ответ в историю пользователя"""
+        if user_id is not None:
+            self.add_to_history(user_id, "user", question)
+            self.add_to_history(user_id, "assistant", answer)
+
+        self.logger.info(
+            "dialog info for user %s:\nquestion: %s\nanswer: %s",
+            user_id if user_id else "unknown",
+            question[: min(100, len(question))],
+            answer[: min(len(answer), 100)],
+        )
@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Generic,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+# элементы пачки -> результат или исключение для каждого, в том же порядке
+BatchHandler = Callable[[List[T]], Awaitable[List[Any]]]
+
+
+@dataclass
+class BatchConfig:
+    """Окно сбора пачки в секундах (0 - без пачек) и её предельный размер"""
+
+    window: float = 0.0
+    max_size: int = 16
+
+
+class MicroBatcher(Generic[T]):
+    """
+    Собирает элементы, пришедшие за window секунд (или до max_size), в одну
+    пачку и возвращает каждому ожидающему его собственный результат.
+    """
+
+    def __init__(self, handle: BatchHandler, config: BatchConfig):
+        self.handle = handle
+        self.config = config
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.config.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.config.window, self.flush)
+        return await future
+
+    def flush(self):
+        """Отправить собранную пачку, не дожидаясь конца окна"""
+        if not self._pending:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # пустой контекст: стадии пачки не попадают в трассу одного из запросов
+        task = asyncio.get_running_loop().create_task(
+            self._run(batch), context=contextvars.Context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future]]):
+        try:
+            results = await self.handle([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            # ожидающий мог быть отменён, пока пачка выполнялась
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,133 @@
+import asyncio
+import importlib.util
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclass
+class HttpClientConfig:
+    """Настройки общего HTTP-клиента"""
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    http2: bool = True
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    retry_after_max: float = 30.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах (число или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SharedHttpClient:
+    """Один httpx.AsyncClient (и один пул соединений) на весь процесс"""
+
+    config = HttpClientConfig()
+    _client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def configure(cls, config: HttpClientConfig):
+        """Задать настройки; применяются при следующем создании клиента"""
+        cls.config = config
+
+    @classmethod
+    def get(cls) -> httpx.AsyncClient:
+        """Получить общий клиент, создав его при первом обращении"""
+        if cls._client is None or cls._client.is_closed:
+            http2 = cls.config.http2 and importlib.util.find_spec("h2") is not None
+            cls._client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=cls.config.max_connections,
+                    max_keepalive_connections=cls.config.max_keepalive_connections,
+                    keepalive_expiry=30.0,
+                ),
+            )
+        return cls._client
+
+    @classmethod
+    async def close(cls):
+        """Закрыть общий клиент и все соединения пула"""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    @classmethod
+    def backoff(cls, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Пауза перед повтором: Retry-After или экспонента с полным джиттером"""
+        if retry_after is not None:
+            return min(retry_after, cls.config.retry_after_max)
+        cap = min(cls.config.backoff_max, cls.config.backoff_base * 2**attempt)
+        return random.uniform(0, cap)
+
+    @classmethod
+    async def post(cls, url: str, **kwargs) -> httpx.Response:
+        """POST с ограниченным числом повторов на 429/5xx и сетевых ошибках"""
+        return await cls._send_with_retries(url, stream=False, **kwargs)
+
+    @classmethod
+    @asynccontextmanager
+    async def stream_post(cls, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Потоковый POST; повторы возможны только до начала чтения тела"""
+        response = await cls._send_with_retries(url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    @classmethod
+    async def _send_with_retries(
+        cls, url: str, stream: bool, **kwargs
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            client = cls.get()
+            try:
+                response = await client.send(
+                    client.build_request("POST", url, **kwargs), stream=stream
+                )
+            except httpx.TransportError as e:
+                if attempt >= cls.config.max_retries:
+                    raise
+                delay = cls.backoff(attempt)
+                logger.warning(
+                    "%s failed (%s), retry in %.2fs", url, type(e).__name__, delay
+                )
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= cls.config.max_retries
+                ):
+                    return response
+                await response.aclose()
+                delay = cls.backoff(
+                    attempt, parse_retry_after(response.headers.get("Retry-After"))
+                )
+                logger.warning(
+                    "%s returned %s, retry in %.2fs", url, response.status_code, delay
+                )
+            attempt += 1
+            await asyncio.sleep(delay)
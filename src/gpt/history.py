@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from common.tokens import estimate_tokens
+
+from .storage import HistoryStore, InMemoryHistoryStore, Message
+
+# (предыдущее резюме, вытесняемые сообщения) -> новое резюме
+Summarizer = Callable[[str, List[Message]], Awaitable[str]]
+
+
+@dataclass
+class HistoryConfig:
+    """Ограничения истории одного пользователя"""
+
+    max_tokens: int = 2000  # бюджет истории в одном запросе
+    max_messages: int = 50  # скользящее окно хранимых сообщений
+    max_summary_tokens: int = 400
+
+
+class HistoryManager:
+    """
+    Политика истории: бюджет токенов, скользящее окно и резюме старых реплик.
+    Резюме готовится в фоне, по одной задаче на пользователя; пока оно не
+    готово, в запрос уходит только окно, укладывающееся в бюджет.
+    """
+
+    def __init__(
+        self,
+        config: Optional[HistoryConfig] = None,
+        summarizer: Optional[Summarizer] = None,
+        store: Optional[HistoryStore] = None,
+    ):
+        self.config = config or HistoryConfig()
+        self.summarizer = summarizer
+        self.store = store if store is not None else InMemoryHistoryStore()
+        self._folding: Dict[int, asyncio.Task] = {}
+
+    async def messages(self, user_id: int) -> List[Message]:
+        """Хранимые (ещё не свёрнутые в резюме) сообщения пользователя"""
+        return list((await self.store.load(user_id)).messages)
+
+    def add(self, user_id: int, role: str, text: str):
+        self.store.append(user_id, role, text)
+        history = self.store.get(user_id)
+        # по непрочитанной копии не видно, сколько сообщений на самом деле
+        if history.loaded and len(history.messages) > self.config.max_messages:
+            self._fold_later(user_id)
+
+    def clear(self, user_id: int) -> bool:
+        task = self._folding.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        return self.store.clear(user_id)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    async def context(self, user_id: int) -> Tuple[str, List[Message]]:
+        """Резюме и последние сообщения, укладывающиеся в бюджет токенов"""
+        history = await self.store.load(user_id)
+        keep = self._window(history.messages)
+        if keep < len(history.messages):
+            self._fold_later(user_id)
+        return history.summary, history.messages[len(history.messages) - keep :]
+
+    async def close(self):
+        """Прервать недописанные резюме и закрыть хранилище"""
+        tasks = list(self._folding.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.store.close()
+
+    def _window(self, messages: List[Message]) -> int:
+        """Сколько последних сообщений укладывается в бюджет и окно"""
+        budget = self.config.max_tokens
+        keep = 0
+        for message in reversed(messages[-self.config.max_messages :]):
+            budget -= estimate_tokens(message.text)
+            if budget < 0:
+                break
+            keep += 1
+        return keep
+
+    def _fold_later(self, user_id: int):
+        if user_id in self._folding:
+            return
+        # пустой контекст: вызов модели не попадает в трассу запроса
+        task = asyncio.get_running_loop().create_task(
+            self._fold(user_id), context=contextvars.Context()
+        )
+        self._folding[user_id] = task
+        task.add_done_callback(lambda _: self._folding.pop(user_id, None))
+
+    async def _fold(self, user_id: int):
+        """Свернуть в резюме всё, что не попадает в окно"""
+        history = self.store.get(user_id)
+        old = history.messages[: len(history.messages) - self._window(history.messages)]
+        if not old:
+            return
+        summary = await self._summarize(history.summary, old)
+        # пока ждали резюме, история могла измениться или выгрузиться
+        history = self.store.get(user_id)
+        if history.loaded and history.messages[: len(old)] == old:
+            self.store.compact(user_id, len(old), summary)
+
+    async def _summarize(self, summary: str, messages: List[Message]) -> str:
+        if self.summarizer is None:
+            return summary
+        try:
+            summary = await self.summarizer(summary, messages)
+        except Exception:
+            # без резюме старые реплики просто выпадают из окна
+            return summary
+        return summary[: self.config.max_summary_tokens * 3]
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+import jwt
+
+from .client import SharedHttpClient
+from .exceptions import YandexGptException
+
+IAM_URL = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
+
+logger = logging.getLogger(__name__)
+
+
+class TokenProvider:
+    """Источник IAM-токена для запросов к API"""
+
+    async def get_token(self) -> str:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StaticTokenProvider(TokenProvider):
+    """Фиксированный токен: тесты, бенчмарки, заглушки API"""
+
+    def __init__(self, token: str = "test-token"):
+        self.token = token
+
+    async def get_token(self) -> str:
+        return self.token
+
+
+class IamTokenProvider(TokenProvider):
+    """
+    IAM-токен сервисного аккаунта, один на все экземпляры бота. Обновление -
+    одним запросом под замком; фоновая задача обновляет токен заранее, так что
+    запросы пользователей его не ждут.
+    """
+
+    def __init__(self, config, ttl: float = 3500, refresh_margin: float = 300):
+        # YandexGPTConfig: service_account_id, key_id, private_key, iam_url
+        self.config = config
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.token: Optional[str] = None
+        self.expires = 0.0
+        self._lock = asyncio.Lock()
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def get_token(self) -> str:
+        self._start_refresher()
+        if self.token and time.time() < self.expires:
+            return self.token
+        async with self._lock:
+            # пока ждали замок, токен мог обновить другой запрос
+            if not self.token or time.time() >= self.expires:
+                await self._refresh()
+            return self.token
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    def _start_refresher(self):
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(
+                self._refresh_loop()
+            )
+
+    async def _refresh_loop(self):
+        failures = 0
+        while True:
+            delay = self.expires - self.refresh_margin - time.time()
+            if failures:
+                delay = min(2**failures + random.random(), self.refresh_margin / 2)
+            await asyncio.sleep(max(delay, 0))
+            try:
+                async with self._lock:
+                    if time.time() >= self.expires - self.refresh_margin:
+                        await self._refresh()
+                failures = 0
+            except Exception:
+                # старый токен ещё действует; пробуем снова с паузой
+                failures += 1
+
+    async def _refresh(self):
+        try:
+            now = int(time.time())
+            payload = {
+                "aud": IAM_URL,
+                "iss": self.config.service_account_id,
+                "iat": now,
+                "exp": now + 360,
+            }
+
+            encoded_token = jwt.encode(
+                payload,
+                self.config.private_key,
+                algorithm="PS256",
+                headers={"kid": self.config.key_id},
+            )
+
+            response = await SharedHttpClient.post(
+                self.config.iam_url, json={"jwt": encoded_token}, timeout=10
+            )
+
+            if response.status_code != 200:
+                raise YandexGptException(f"Ошибка генерации токена: {response.text}")
+
+            self.token = response.json()["iamToken"]
+            self.expires = now + self.ttl
+            logger.info("IAM token generated successfully")
+
+        except Exception as e:
+            logger.error("Error generating IAM token: %s", str(e))
+            raise
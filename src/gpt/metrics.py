@@ -0,0 +1,289 @@
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .http_server import HttpRequest, HttpServer, send_response
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# секунды: от попадания в кэш до долгого ответа модели
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = Tuple[str, ...]
+
+# стадии текущего запроса: stage -> секунды (см. Metrics.trace)
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("trace", default=None)
+
+
+def _labels(names: Tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0.0) + amount
+
+    def value(self, *values: str) -> float:
+        return self._values.get(values, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labels, v)} {n:g}" for v, n in items]
+
+
+class Histogram:
+    """Гистограмма Prometheus: кумулятивные бакеты, сумма и количество"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # метки -> (счётчики по бакетам + переполнение, [сумма])
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values: str):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(values) or self._values.setdefault(
+                values, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[slot] += 1
+            total[0] += value
+
+    def count(self, *values: str) -> int:
+        entry = self._values.get(values)
+        return sum(entry[0]) if entry else 0
+
+    def snapshot(self) -> Dict[LabelValues, Tuple[int, float]]:
+        """метки -> (количество, сумма)"""
+        with self._lock:
+            return {v: (sum(c), t[0]) for v, (c, t) in self._values.items()}
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((v, (list(c), t[0])) for v, (c, t) in self._values.items())
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                labels = _labels((*self.labels, "le"), (*values, f"{bound}"))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое читается при сборе метрик (очередь, hit rate)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, read: Callable[[], float]):
+        self.name = name
+        self.doc = doc
+        self.read = read
+
+    def value(self) -> float:
+        return float(self.read())
+
+    def render(self) -> List[str]:
+        try:
+            return [f"{self.name} {self.value():g}"]
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, e)
+            return []
+
+
+class Span:
+    """Замер одной стадии; пишет в гистограмму и в трассу запроса"""
+
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self) -> "Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            self.metrics.stage_errors.inc(self.stage)
+
+
+class Trace:
+    """Все стадии одного запроса; медленный запрос - одна строка JSON в лог"""
+
+    def __init__(self, metrics: "Metrics", kind: str):
+        self.metrics = metrics
+        self.kind = kind
+        self.stages: Dict[str, float] = {}
+        self._span = Span(metrics, kind)
+        self._token = None
+
+    def __enter__(self) -> "Trace":
+        self._token = _trace.set(self.stages)
+        self._span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.__exit__(exc_type, exc, tb)
+        _trace.reset(self._token)
+        total = self.stages.pop(self.kind, 0.0)
+        if self.metrics.slow_request and total >= self.metrics.slow_request:
+            logger.warning(
+                "slow request %s",
+                json.dumps(
+                    {
+                        "kind": self.kind,
+                        "total": round(total, 3),
+                        "stages": {k: round(v, 3) for k, v in self.stages.items()},
+                    }
+                ),
+            )
+
+
+@dataclass
+class ApiMetrics:
+    """Счётчики ответов Yandex API по вызывающему (chat, validator, summary)"""
+
+    requests: Counter  # caller, status
+    tokens: Counter  # caller, kind: input | completion
+    bytes: Counter  # caller
+
+    def record(self, caller: str, status: int, payload: Dict, size: int):
+        self.requests.inc(caller, str(status))
+        self.bytes.inc(caller, amount=size)
+        usage = payload.get("result", {}).get("usage") or {}
+        # Yandex отдаёт числа строками
+        self.tokens.inc(caller, "input", amount=int(usage.get("inputTextTokens", 0)))
+        self.tokens.inc(
+            caller, "completion", amount=int(usage.get("completionTokens", 0))
+        )
+
+
+class Metrics:
+    """
+    Реестр метрик процесса и их HTTP-отдача в формате Prometheus.
+    Стадии пишутся в одну гистограмму stage_seconds{stage=...}: замер - это
+    perf_counter и bisect под замком, его можно держать включённым всегда.
+    """
+
+    def __init__(self, prefix: str = "bot", slow_request: float = 0.0):
+        self.prefix = prefix
+        self.slow_request = slow_request  # 0 - не логировать медленные запросы
+        self._metrics: Dict[str, object] = {}
+        self._server: Optional[HttpServer] = None
+        self.stage_seconds = self.histogram(
+            "stage_seconds", "Длительность стадий обработки запроса", ("stage",)
+        )
+        self.stage_errors = self.counter(
+            "stage_errors_total", "Стадии, завершившиеся исключением", ("stage",)
+        )
+        self.api = ApiMetrics(
+            self.counter(
+                "yandex_requests_total", "Ответы Yandex API", ("caller", "status")
+            ),
+            self.counter(
+                "yandex_tokens_total", "Токены по usage ответов", ("caller", "kind")
+            ),
+            self.counter("yandex_response_bytes_total", "Байты ответов", ("caller",)),
+        )
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, doc: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", doc, labels))
+
+    def histogram(
+        self,
+        name: str,
+        doc: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", doc, labels, buckets))
+
+    def gauge(self, name: str, doc: str, read: Callable[[], float]) -> Gauge:
+        gauge = Gauge(f"{self.prefix}_{name}", doc, read)
+        # повторная регистрация (новое поколение индекса) заменяет источник
+        self._metrics[gauge.name] = gauge
+        return gauge
+
+    def observe(self, stage: str, seconds: float):
+        """Записать длительность стадии (для замеров без with)"""
+        self.stage_seconds.observe(seconds, stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + seconds
+
+    def span(self, stage: str) -> Span:
+        return Span(self, stage)
+
+    def trace(self, kind: str) -> Trace:
+        return Trace(self, kind)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100):
+        """GET /metrics на локальном порту, в том же event loop, что и бот"""
+        self._server = HttpServer(self._handle, idle_timeout=60)
+        await self._server.start(host, port)
+        logger.info("Metrics endpoint: http://%s:%d/metrics", *self._server.address)
+
+    async def close(self):
+        if self._server is not None:
+            await self._server.close()
+            self._server = None
+
+    async def _handle(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        if request.path.split("?")[0] != "/metrics":
+            await send_response(writer, 404, b"not found\n", CONTENT_TYPE)
+            return
+        await send_response(writer, 200, self.render().encode("utf-8"), CONTENT_TYPE)
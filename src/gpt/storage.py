@@ -0,0 +1,303 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class Message:
+    """Сообщение в истории диалога"""
+
+    role: str  # "user" или "assistant"
+    text: str
+    # номер строки в хранилище; присваивается при записи, в сравнении не участвует
+    id: Optional[int] = field(default=None, compare=False, repr=False)
+
+
+@dataclass
+class UserHistory:
+    messages: List[Message] = field(default_factory=list)
+    summary: str = ""
+    last_used: float = field(default_factory=time.monotonic)
+    # False - копия не читалась из хранилища и видна только её хвост
+    loaded: bool = True
+
+
+class HistoryStore:
+    """Хранилище историй: рабочий набор в памяти с выгрузкой простаивающих"""
+
+    def __init__(self, idle_ttl: float = 6 * 3600, sweep_interval: float = 60.0):
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._cache: Dict[int, UserHistory] = {}
+        self._last_sweep = time.monotonic()
+
+    def get(self, user_id: int) -> UserHistory:
+        """Рабочая копия истории в памяти, без обращения к диску"""
+        self._evict_idle()
+        history = self._cache.get(user_id)
+        if history is None:
+            history = self._cache[user_id] = self._empty()
+        history.last_used = time.monotonic()
+        return history
+
+    async def load(self, user_id: int) -> UserHistory:
+        """Актуальная история пользователя (в начале каждого запроса)"""
+        return self.get(user_id)
+
+    def append(self, user_id: int, role: str, text: str):
+        history = self.get(user_id)
+        history.messages.append(Message(role=role, text=text))
+        self._write_message(user_id, history.messages[-1])
+
+    def compact(self, user_id: int, count: int, summary: str):
+        """Убрать count самых старых сообщений, заменив резюме"""
+        history = self.get(user_id)
+        count = min(count, len(history.messages))
+        if not count:
+            return
+        last = history.messages[count - 1]
+        del history.messages[:count]
+        history.summary = summary
+        self._write_summary(user_id, summary, last)
+
+    def clear(self, user_id: int) -> bool:
+        history = self.get(user_id)
+        existed = bool(history.messages or history.summary or not history.loaded)
+        history.messages.clear()
+        history.summary = ""
+        self._write_summary(user_id, "", None)
+        return existed
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        idle = [
+            user_id
+            for user_id, history in self._cache.items()
+            if now - history.last_used > self.idle_ttl
+        ]
+        for user_id in idle:
+            del self._cache[user_id]
+
+    def _empty(self) -> UserHistory:
+        return UserHistory()
+
+    def _write_message(self, user_id: int, message: Message):
+        pass
+
+    def _write_summary(self, user_id: int, summary: str, last: Optional[Message]):
+        """last - последнее свёрнутое сообщение, None - все записанные до сих пор"""
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.flush()
+
+
+class InMemoryHistoryStore(HistoryStore):
+    """История только в памяти процесса, пропадает при перезапуске"""
+
+
+# ("message", user_id, Message) | ("summary", user_id, (summary, last))
+PendingOp = Tuple[str, int, object]
+
+
+class SqliteHistoryStore(HistoryStore):
+    """
+    История в SQLite: сообщения только дописываются, номер строки выдаёт база,
+    запись пачками в фоновом потоке. В начале каждого запроса история
+    перечитывается, поэтому один файл (WAL) могут делить несколько процессов
+    бота на одной машине: записи соседа видны после его сброса (flush_interval).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        shards: int = 1,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._conns = [
+            self._connect(self._shard_path(path, n, shards)) for n in range(shards)
+        ]
+        self._pending: List[PendingOp] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _shard_path(path: str, n: int, shards: int) -> str:
+        if shards == 1:
+            return path
+        p = Path(path)
+        return str(p.with_name(f"{p.stem}.{n}{p.suffix}"))
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "role TEXT NOT NULL, text TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS chat_messages_user "
+            "ON chat_messages (user_id, id)"
+        )
+        # upto_id - последнее свёрнутое в резюме сообщение
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_summaries ("
+            "user_id INTEGER PRIMARY KEY, summary TEXT NOT NULL, "
+            "upto_id INTEGER NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def _conn(self, user_id: int) -> sqlite3.Connection:
+        return self._conns[user_id % len(self._conns)]
+
+    def _empty(self) -> UserHistory:
+        # на диске может быть больше: полную историю читает load()
+        return UserHistory(loaded=False)
+
+    async def load(self, user_id: int) -> UserHistory:
+        # чтение (и сброс, который оно требует) - не в event loop
+        history = await asyncio.to_thread(self._read, user_id)
+        with self._lock:
+            # дописанное, пока шло чтение, в выборку не попало
+            history.messages.extend(
+                op[2] for op in self._pending if op[0] == "message" and op[1] == user_id
+            )
+        self._cache[user_id] = history
+        return history
+
+    def _read(self, user_id: int) -> UserHistory:
+        # неотправленные записи этого пользователя должны попасть в выборку;
+        # чужие ждут своей пачки
+        self._flush_sync(user_id)
+        conn = self._conn(user_id)
+        with self._lock:
+            row = conn.execute(
+                "SELECT summary, upto_id FROM chat_summaries WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+            summary, upto_id = row if row else ("", 0)
+            rows = conn.execute(
+                "SELECT id, role, text FROM chat_messages "
+                "WHERE user_id = ? AND id > ? ORDER BY id",
+                (user_id, upto_id),
+            ).fetchall()
+        return UserHistory(
+            messages=[Message(role=r, text=t, id=i) for i, r, t in rows],
+            summary=summary,
+        )
+
+    def _write_message(self, user_id: int, message: Message):
+        with self._lock:
+            self._pending.append(("message", user_id, message))
+        self._schedule_flush()
+
+    def _write_summary(self, user_id: int, summary: str, last: Optional[Message]):
+        with self._lock:
+            self._pending.append(("summary", user_id, (summary, last)))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if len(self._pending) >= self.batch_size:
+            self._start_flusher(delay=0)
+        else:
+            self._start_flusher(delay=self.flush_interval)
+
+    def _start_flusher(self, delay: float):
+        if self._flusher is not None and not self._flusher.done():
+            if delay > 0:
+                return
+            self._flusher.cancel()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # вне event loop (скрипты, тесты) пишем сразу
+            self._flush_sync()
+            return
+        self._flusher = loop.create_task(self._delayed_flush(delay))
+
+    async def _delayed_flush(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения в фоновом потоке"""
+        await asyncio.to_thread(self._flush_sync)
+
+    def _flush_sync(self, only_user: Optional[int] = None):
+        """Записать накопленное; only_user - только записи этого пользователя"""
+        with self._lock:
+            if only_user is None:
+                ops, self._pending = self._pending, []
+            else:
+                ops = [op for op in self._pending if op[1] == only_user]
+                if ops:
+                    self._pending = [op for op in self._pending if op[1] != only_user]
+            if not ops:
+                return
+            # по порядку: резюме ссылается на уже записанные сообщения
+            # того же пользователя, поэтому его записи можно сбросить отдельно
+            for kind, user_id, payload in ops:
+                conn = self._conn(user_id)
+                if kind == "message":
+                    payload.id = conn.execute(
+                        "INSERT INTO chat_messages (user_id, role, text) "
+                        "VALUES (?, ?, ?)",
+                        (user_id, payload.role, payload.text),
+                    ).lastrowid
+                else:
+                    self._fold(conn, user_id, *payload)
+            for conn in {self._conn(user_id) for _, user_id, _ in ops}:
+                conn.commit()
+
+    @staticmethod
+    def _fold(
+        conn: sqlite3.Connection, user_id: int, summary: str, last: Optional[Message]
+    ):
+        if last is not None:
+            upto_id = last.id
+        else:
+            upto_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM chat_messages WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()[0]
+        # граница только растёт: соседний процесс мог свернуть больше
+        conn.execute(
+            "INSERT INTO chat_summaries (user_id, summary, upto_id) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET "
+            "summary = excluded.summary, upto_id = excluded.upto_id "
+            "WHERE excluded.upto_id >= chat_summaries.upto_id",
+            (user_id, summary, upto_id),
+        )
+        conn.execute(
+            "DELETE FROM chat_messages WHERE user_id = ? AND id <= ?",
+            (user_id, upto_id),
+        )
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await self.flush()
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
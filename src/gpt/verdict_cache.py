@@ -0,0 +1,27 @@
+import hashlib
+from typing import Optional
+
+from common.cache import AsyncCache, LRUCache, normalize_query
+
+
+def prompt_key(prompt: str) -> str:
+    """Регистр и пробелы не влияют на вердикт"""
+    return hashlib.sha256(normalize_query(prompt).encode("utf-8")).hexdigest()
+
+
+class VerdictCache(AsyncCache):
+    """
+    Кэш вердиктов Validator: prompt_key -> bool. Бэкенд - LRUCache в памяти
+    процесса или SqliteCache, общий для реплик и переживающий перезапуски.
+    """
+
+    def __init__(self, backend=None):
+        super().__init__(
+            backend if backend is not None else LRUCache(10000, ttl=24 * 3600)
+        )
+
+    async def get_verdict(self, prompt: str) -> Optional[bool]:
+        return await self.get(prompt_key(prompt))
+
+    async def set_verdict(self, prompt: str, verdict: bool):
+        await self.put(prompt_key(prompt), verdict)
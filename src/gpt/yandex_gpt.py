@@ -1,22 +1,120 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
 from .base_yandex_gpt import BaseYandexGPTBot
+from .batcher import BatchConfig
 from .prompt_validation import Validator
+from .verdict_cache import VerdictCache
+
+REFUSAL_MESSAGE = "Как Тётя Джулия, я не могу ответить на этот вопрос."
+
+
+@dataclass
+class SpeculationStats:
+    """Статистика спекулятивного режима"""
+
+    requests: int = 0
+    discarded: int = 0
+    saved_seconds: float = 0.0
 
 
 class YandexGPTBot(BaseYandexGPTBot):
-    def __init__(self, config):
-        super().__init__(config)
-        self.validator = Validator(config)
+    refusal_message = REFUSAL_MESSAGE
 
-    def unsafe_ask_gpt(self, question: str, user_id: int = None):
+    def __init__(
+        self,
+        config,
+        speculative: bool = False,
+        verdict_cache: Optional[VerdictCache] = None,
+        validation_batch: Optional[BatchConfig] = None,
+        **kwargs,
+    ):
+        """kwargs - history_config, history_store, token_provider, metrics базового бота"""
+        super().__init__(config, **kwargs)
+        # один токен на бота и валидатор
+        self.validator = Validator(
+            config,
+            verdict_cache=verdict_cache,
+            batch_config=validation_batch,
+            token_provider=self.token_provider,
+            metrics=self.metrics,
+        )
+        self.speculative = speculative
+        self.speculation_stats = SpeculationStats()
+
+    async def unsafe_ask_gpt(self, question: str, user_id: int = None):
         raise AttributeError("'YandexGPTBot' object has no attribute 'unsafe_ask_gpt'")
 
-    def ask_gpt(self, question: str, user_id: int) -> str:
+    async def unsafe_ask_gpt_stream(self, question: str, user_id: int = None):
+        raise AttributeError(
+            "'YandexGPTBot' object has no attribute 'unsafe_ask_gpt_stream'"
+        )
+
+    async def ask_gpt(self, question: str, user_id: int) -> str:
         """Задать вопрос GPT с валидацией и историей пользователя"""
-        is_valid_prompt = self.validator.check_prompt(question)
+        if self.speculative:
+            return await self._ask_gpt_speculative(question, user_id)
+
+        is_valid_prompt = await self.validator.check_prompt(question)
         if not is_valid_prompt:
-            return "Как Тётя Джулия, я не могу ответить на этот вопрос."
+            return REFUSAL_MESSAGE
+
+        return await super().unsafe_ask_gpt(question, user_id)
+
+    async def ask_gpt_stream(self, question: str, user_id: int) -> AsyncIterator[str]:
+        """Потоковый ответ GPT: накопленный текст отдаётся только после валидации"""
+        is_valid_prompt = await self.validator.check_prompt(question)
+        if not is_valid_prompt:
+            yield REFUSAL_MESSAGE
+            return
+
+        async for answer in super().unsafe_ask_gpt_stream(question, user_id):
+            yield answer
+
+    async def _ask_gpt_speculative(self, question: str, user_id: int) -> str:
+        """Валидация и генерация параллельно, в историю - только при вердикте Да"""
+        started = time.monotonic()
+        answer_task = asyncio.create_task(self._timed_complete(question, user_id))
+
+        try:
+            is_valid_prompt = await self.validator.check_prompt(question)
+        except BaseException:
+            self._discard(answer_task)
+            raise
+        validation_time = time.monotonic() - started
+
+        self.speculation_stats.requests += 1
+        if not is_valid_prompt:
+            self._discard(answer_task)
+            self.speculation_stats.discarded += 1
+            return REFUSAL_MESSAGE
+
+        answer, answer_time = await answer_task
+        self._commit_answer(question, answer, user_id)
+
+        # последовательно было бы validation_time + answer_time
+        saved = validation_time + answer_time - (time.monotonic() - started)
+        self.speculation_stats.saved_seconds += saved
+        self.logger.info(
+            "speculative answer for user %s: saved %.3fs (total saved %.1fs)",
+            user_id,
+            saved,
+            self.speculation_stats.saved_seconds,
+        )
+        return answer
+
+    async def _timed_complete(self, question: str, user_id: int):
+        started = time.monotonic()
+        answer = await self._complete(question, user_id)
+        return answer, time.monotonic() - started
 
-        return super().unsafe_ask_gpt(question, user_id)
+    @staticmethod
+    def _discard(task: asyncio.Task):
+        """Отменить спекулятивный ответ и забрать его исключение, если оно есть"""
+        task.cancel()
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
     def reset_user_history(self, user_id: int):
         """Сбросить историю пользователя"""
@@ -5,9 +5,28 @@ from dotenv import load_dotenv
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
 from bot.bot import BotHandlers
-from gpt.base_yandex_gpt import YandexGPTConfig
+from bot.scheduler import RequestScheduler, SchedulerConfig
+from bot.updates import ChatOrderedUpdateProcessor, DrainingApplication
+from common.cache import LRUCache, SqliteCache
+from gpt.base_yandex_gpt import COMPLETION_URL, YandexGPTConfig
+from gpt.batcher import BatchConfig
+from gpt.client import HttpClientConfig, SharedHttpClient
+from gpt.history import HistoryConfig
+from gpt.iam import IAM_URL
+from gpt.metrics import Metrics
+from gpt.storage import InMemoryHistoryStore, SqliteHistoryStore
+from gpt.verdict_cache import VerdictCache
 from gpt.yandex_gpt import YandexGPTBot
 from rag import rag
+from rag.cache import AnswerCache
+from rag.embedding import LazyEmbedder
+from rag_settings import (
+    RAG_INDEX_DIR,
+    RAG_REFRESH_BUILD,
+    RAG_REFRESH_INTERVAL,
+    build_index,
+    store_cfg,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -20,15 +39,115 @@ SERVICE_ACCOUNT_ID = os.environ["ACCOUNT_ID"]
 KEY_ID = os.environ["KEY_ID"]
 PRIVATE_KEY = os.environ["PRIVATE_KEY"].replace("\\n", "\n")
 FOLDER_ID = os.environ["FOLDER_ID"]
+YANDEX_COMPLETION_URL = os.environ.get("YANDEX_COMPLETION_URL") or COMPLETION_URL
+YANDEX_IAM_URL = os.environ.get("YANDEX_IAM_URL") or IAM_URL
 TELEGRAM_TOKEN = os.environ["BOT_TOKEN"]
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "32"))
+# 0: порядок сообщений держит RequestScheduler (один запрос пользователя в работе,
+# пришедшие в очереди склеиваются); 1: Update чата строго по одному, но тогда
+# в очереди планировщика не бывает двух сообщений и склейка не срабатывает
+CHAT_ORDERED_UPDATES = os.environ.get("CHAT_ORDERED_UPDATES", "0") == "1"
+UPDATE_DRAIN_TIMEOUT = float(os.environ.get("UPDATE_DRAIN_TIMEOUT", "25"))
+# polling - для локальной разработки, webhook - для продакшена
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+SPECULATIVE_VALIDATION = os.environ.get("SPECULATIVE_VALIDATION", "0") == "1"
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_IDLE_TTL = float(os.environ.get("HISTORY_IDLE_TTL", "21600"))
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", "")
+HISTORY_DB_SHARDS = int(os.environ.get("HISTORY_DB_SHARDS", "1"))
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "0") == "1"
+VERDICT_CACHE_SIZE = int(os.environ.get("VERDICT_CACHE_SIZE", "10000"))
+VERDICT_CACHE_TTL = float(os.environ.get("VERDICT_CACHE_TTL", "86400"))
+VERDICT_CACHE_PATH = os.environ.get("VERDICT_CACHE_PATH", "")
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_SLOW_REQUEST = float(os.environ.get("METRICS_SLOW_REQUEST", "10"))
+
+scheduler_cfg = SchedulerConfig(
+    max_concurrent=int(os.environ.get("API_MAX_CONCURRENT", "8")),
+    rps=float(os.environ.get("API_RPS", "5")),
+    max_wait=float(os.environ.get("API_MAX_WAIT", "20")),
+)
+
+http_cfg = HttpClientConfig(
+    max_connections=int(os.environ.get("HTTP_POOL_SIZE", "100")),
+    max_retries=int(os.environ.get("HTTP_MAX_RETRIES", "3")),
+    http2=os.environ.get("HTTP2", "1") == "1",
+)
+
+# окно сбора промптов валидатора в одну пачку, 0 - проверять по одному
+validation_batch_cfg = BatchConfig(
+    window=float(os.environ.get("VALIDATION_BATCH_WINDOW", "0")),
+    max_size=int(os.environ.get("VALIDATION_BATCH_SIZE", "16")),
+)
+
+RAG_ANSWER_CACHE_SIZE = int(os.environ.get("RAG_ANSWER_CACHE_SIZE", "0"))
+RAG_ANSWER_CACHE_TTL = float(os.environ.get("RAG_ANSWER_CACHE_TTL", "3600"))
+RAG_ANSWER_CACHE_PATH = os.environ.get("RAG_ANSWER_CACHE_PATH", "")
+
+
+def make_verdict_cache():
+    """Кэш вердиктов валидатора: SQLite, если задан путь, иначе в памяти"""
+    if VERDICT_CACHE_SIZE <= 0:
+        return None
+    if VERDICT_CACHE_PATH:
+        return VerdictCache(
+            SqliteCache(
+                VERDICT_CACHE_PATH, max_size=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL
+            )
+        )
+    return VerdictCache(LRUCache(VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL))
+
+
+def make_answer_cache():
+    """
+    Кэш ответов /rag (по умолчанию выключен): SQLite или память.
+    С кэшем ответы /rag генерируются без истории диалога пользователя.
+    """
+    if RAG_ANSWER_CACHE_SIZE <= 0:
+        return None
+    if RAG_ANSWER_CACHE_PATH:
+        return AnswerCache(
+            SqliteCache(
+                RAG_ANSWER_CACHE_PATH,
+                max_size=RAG_ANSWER_CACHE_SIZE,
+                ttl=RAG_ANSWER_CACHE_TTL,
+            )
+        )
+    return AnswerCache(LRUCache(RAG_ANSWER_CACHE_SIZE, ttl=RAG_ANSWER_CACHE_TTL))
 
-s3_cfg = {
-    "endpoint": os.environ["S3_ENDPOINT"],
-    "access_key": os.environ["S3_ACCESS_KEY"],
-    "secret_key": os.environ["S3_SECRET_KEY"],
-    "bucket": os.environ["S3_BUCKET"],
-    "prefix": os.environ.get("S3_PREFIX", ""),
-}
+
+def make_history_store():
+    """Хранилище истории: SQLite, если задан путь, иначе в памяти"""
+    if HISTORY_DB_PATH:
+        return SqliteHistoryStore(
+            HISTORY_DB_PATH, shards=HISTORY_DB_SHARDS, idle_ttl=HISTORY_IDLE_TTL
+        )
+    return InMemoryHistoryStore(idle_ttl=HISTORY_IDLE_TTL)
+
+
+def run(application: Application):
+    """Получение Update: вебхук или long polling"""
+    if BOT_MODE == "webhook":
+        # публичный HTTPS-адрес, на который Telegram шлёт Update
+        webhook_url = os.environ["WEBHOOK_URL"].rstrip("/")
+        logger.info("Бот запускается в режиме webhook...")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{webhook_url}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        return
+    logger.info("Бот запускается...")
+    application.run_polling()
 
 
 def main():
@@ -36,18 +155,92 @@ def main():
     try:
         logger.info("Инициализация компонентов...")
 
-        global_vector_store = rag.prepare_index(s3_cfg)
+        SharedHttpClient.configure(http_cfg)
+
+        metrics = Metrics(slow_request=METRICS_SLOW_REQUEST)
+        # одна модель на все поколения индекса, грузится при первом запросе
+        embedder = LazyEmbedder(store_cfg.embedder)
+        store_kwargs = {
+            "config": store_cfg,
+            "embedder": embedder,
+            "metrics": metrics,
+        }
+        global_vector_store = rag.open_version(RAG_INDEX_DIR, **store_kwargs)
+        if global_vector_store is None:
+            # первый запуск: версии ещё нет, собираем здесь
+            build_index(embedder)
+            global_vector_store = rag.open_version(RAG_INDEX_DIR, **store_kwargs)
 
         yandex_bot = YandexGPTBot(
-            YandexGPTConfig(SERVICE_ACCOUNT_ID, KEY_ID, PRIVATE_KEY, FOLDER_ID)
+            YandexGPTConfig(
+                SERVICE_ACCOUNT_ID,
+                KEY_ID,
+                PRIVATE_KEY,
+                FOLDER_ID,
+                completion_url=YANDEX_COMPLETION_URL,
+                iam_url=YANDEX_IAM_URL,
+            ),
+            speculative=SPECULATIVE_VALIDATION,
+            verdict_cache=make_verdict_cache(),
+            validation_batch=validation_batch_cfg,
+            history_config=HistoryConfig(max_tokens=HISTORY_TOKEN_BUDGET),
+            history_store=make_history_store(),
+            metrics=metrics,
+        )
+
+        handlers = BotHandlers(
+            yandex_bot,
+            global_vector_store,
+            stream_replies=STREAM_REPLIES,
+            answer_cache=make_answer_cache(),
+            scheduler=RequestScheduler(scheduler_cfg),
+        )
+        refresher = rag.IndexRefresher(
+            handlers,
+            RAG_INDEX_DIR,
+            interval=RAG_REFRESH_INTERVAL,
+            build=(lambda: build_index(embedder)) if RAG_REFRESH_BUILD else None,
+            **store_kwargs,
         )
 
-        yandex_bot.get_iam_token()
-        logger.info("IAM token test successful")
+        async def post_init(_application: Application):
+            await yandex_bot.get_iam_token()
+            logger.info("IAM token test successful")
+            refresher.start()
+            if METRICS_PORT:
+                await metrics.serve(METRICS_HOST, METRICS_PORT)
 
-        handlers = BotHandlers(yandex_bot, global_vector_store)
+        async def post_shutdown(_application: Application):
+            await refresher.close()
+            await metrics.close()
+            # свёртка истории в фоне ещё может ходить в API - до закрытия клиента
+            await yandex_bot.history.close()
+            await yandex_bot.token_provider.close()
+            await SharedHttpClient.close()
 
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
+        update_processor = ChatOrderedUpdateProcessor(
+            CONCURRENT_UPDATES,
+            ordered=CHAT_ORDERED_UPDATES,
+            drain_timeout=UPDATE_DRAIN_TIMEOUT,
+        )
+        metrics.gauge(
+            "updates_running", "Update в обработке", lambda: update_processor.running
+        )
+        metrics.gauge(
+            "updates_pending",
+            "Update, ждущие слота или своей очереди в чате",
+            lambda: update_processor.pending,
+        )
+
+        application = (
+            Application.builder()
+            .application_class(DrainingApplication)
+            .token(TELEGRAM_TOKEN)
+            .concurrent_updates(update_processor)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
 
         application.add_handler(CommandHandler("start", handlers.start))
         application.add_handler(CommandHandler("reset", handlers.reset_history))
@@ -60,8 +253,7 @@ def main():
 
         application.add_error_handler(BotHandlers.error_handler)
 
-        logger.info("Бот запускается...")
-        application.run_polling()
+        run(application)
 
     except KeyError as e:
         logger.error("Отсутствует необходимая переменная окружения: %s", str(e))
@@ -0,0 +1,279 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# идентификаторы Julia: push!, @time, Base.show -> base, show
+TOKEN_RE = re.compile(r"@?\w+!?")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+@dataclass
+class BM25Params:
+    k1: float = 1.2
+    b: float = 0.75
+
+
+@dataclass
+class FusionConfig:
+    """Слияние списков по рангам (RRF) и бусты терминов"""
+
+    rrf_k: int = 60
+    vector_weight: float = 1.0
+    bm25_weight: float = 1.0
+    # токен -> множитель итогового score для чанков, где он встречается
+    boosts: Dict[str, float] = field(
+        default_factory=lambda: {"operator": 1.5, "operators": 1.5, "infix": 1.5}
+    )
+
+
+@dataclass
+class ContextConfig:
+    """Сборка контекста: сколько чанков берём и сколько токенов отдаём в промпт"""
+
+    top_k: int = 8
+    context_tokens: int = 2000
+    dedup_threshold: float = 0.8  # Жаккар по 3-граммам слов
+
+
+@dataclass
+class RetrievalConfig:
+    """Гибридный поиск: BM25 + вектора, слияние по рангам (RRF)"""
+
+    hybrid: bool = True
+    candidates: int = 50  # кандидатов от каждого ретривера
+    bm25: BM25Params = field(default_factory=BM25Params)
+    fusion: FusionConfig = field(default_factory=FusionConfig)
+    context: ContextConfig = field(default_factory=ContextConfig)
+
+
+def parse_boosts(spec: str) -> Dict[str, float]:
+    """'operator=1.5,infix=1.5' -> {'operator': 1.5, 'infix': 1.5}"""
+    boosts = {}
+    for item in spec.split(","):
+        if item.strip():
+            term, weight = item.split("=")
+            boosts[term.strip().casefold()] = float(weight)
+    return boosts
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Tuple[List[int], float]], k: int = 60
+) -> Dict[int, float]:
+    """Сумма weight / (k + ранг) по всем спискам"""
+    scores: Dict[int, float] = defaultdict(float)
+    for ids, weight in rankings:
+        for rank, i in enumerate(ids):
+            scores[i] += weight / (k + rank + 1)
+    return scores
+
+
+@dataclass
+class _Postings:
+    """Сохранённая часть индекса; массивы открыты через mmap"""
+
+    terms: Dict[str, int] = field(default_factory=dict)
+    # постинги терма n: doc_ids/tfs[offsets[n]:offsets[n + 1]]
+    offsets: np.ndarray = field(default_factory=lambda: np.zeros(1, np.int64))
+    doc_ids: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    tfs: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+    # длины документов, отсортированы по id
+    len_ids: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    lens: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+
+    def term(self, term: str) -> Tuple[slice, bool]:
+        """Срез постингов терма; False - терма нет"""
+        n = self.terms.get(term)
+        if n is None:
+            return slice(0, 0), False
+        return slice(int(self.offsets[n]), int(self.offsets[n + 1])), True
+
+
+class BM25Index:
+    """
+    Инвертированный индекс для BM25. Сохранённые постинги (term -> id, tf)
+    открываются через mmap; добавления и удаления копятся в памяти до save(),
+    как в ChunkStore.
+    """
+
+    def __init__(self, path: Optional[str] = None, params: Optional[BM25Params] = None):
+        self.params = params or BM25Params()
+        self._base = _Postings()
+        self._added: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._added_lens: Dict[int, int] = {}
+        self._removed: Set[int] = set()
+        self._n_docs = 0
+        self._total_len = 0
+        if path and self.exists(path):
+            self._open(path)
+
+    @staticmethod
+    def _files(path: str) -> Dict[str, str]:
+        names = ("offsets", "doc_ids", "tfs", "len_ids", "lens")
+        files = {n: f"{path}.{n}.npy" for n in names}
+        files["meta"] = f"{path}.json"
+        return files
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return all(os.path.exists(f) for f in cls._files(path).values())
+
+    def _open(self, path: str):
+        files = self._files(path)
+        with open(files["meta"], encoding="utf-8") as f:
+            meta = json.load(f)
+        self._base = _Postings(
+            {t: n for n, t in enumerate(meta["terms"])},
+            *(
+                np.load(files[n], mmap_mode="r")
+                for n in ("offsets", "doc_ids", "tfs", "len_ids", "lens")
+            ),
+        )
+        self._added = defaultdict(list)
+        self._added_lens = {}
+        self._removed = set()
+        self._n_docs = len(self._base.len_ids)
+        self._total_len = meta["total_len"]
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def add(self, chunk_id: int, text: str):
+        tokens = tokenize(text)
+        for term, tf in Counter(tokens).items():
+            self._added[term].append((chunk_id, tf))
+        self._added_lens[chunk_id] = len(tokens)
+        self._n_docs += 1
+        self._total_len += len(tokens)
+
+    def remove(self, chunk_id: int):
+        length = self._added_lens.pop(chunk_id, None)
+        if length is None:
+            len_ids = self._base.len_ids
+            row = int(np.searchsorted(len_ids, chunk_id))
+            if row >= len(len_ids) or len_ids[row] != chunk_id:
+                return
+            if chunk_id in self._removed:
+                return
+            length = int(self._base.lens[row])
+        # постинги добавленных отфильтруются по _added_lens
+        self._removed.add(chunk_id)
+        self._n_docs -= 1
+        self._total_len -= length
+
+    def _added_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        added = [p for p in self._added.get(term, ()) if p[0] in self._added_lens]
+        return (
+            np.array([i for i, _ in added], dtype=np.int64),
+            np.array([tf for _, tf in added], dtype=np.int32),
+        )
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(id, tf) живых документов с этим термом"""
+        rows, found = self._base.term(term)
+        added_ids, added_tfs = self._added_postings(term)
+        if not found and not added_ids.size:
+            return added_ids, added_tfs
+        ids = np.concatenate([np.asarray(self._base.doc_ids[rows]), added_ids])
+        tfs = np.concatenate([np.asarray(self._base.tfs[rows]), added_tfs])
+        if self._removed:
+            alive = ~np.isin(ids, np.fromiter(self._removed, dtype=np.int64))
+            ids, tfs = ids[alive], tfs[alive]
+        return ids, tfs
+
+    def _doc_lens(self, ids: np.ndarray) -> np.ndarray:
+        len_ids = self._base.len_ids
+        rows = np.searchsorted(len_ids, ids)
+        rows = np.minimum(rows, max(len(len_ids) - 1, 0))
+        lens = np.zeros(len(ids), dtype=np.float32)
+        if len(len_ids):
+            found = len_ids[rows] == ids
+            lens[found] = self._base.lens[rows[found]]
+        if self._added_lens:
+            for n, i in enumerate(ids.tolist()):
+                if i in self._added_lens:
+                    lens[n] = self._added_lens[i]
+        return lens
+
+    def _term_scores(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(id, вклад терма в BM25) живых документов с этим термом"""
+        k1, b = self.params.k1, self.params.b
+        ids, tfs = self.postings(term)
+        df = len(ids)
+        idf = math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+        avgdl = self._total_len / self._n_docs
+        norm = k1 * (1 - b + b * self._doc_lens(ids) / avgdl)
+        return ids, idf * tfs * (k1 + 1) / (tfs + norm)
+
+    def search(self, query: str, limit: int) -> List[int]:
+        if not self._n_docs:
+            return []
+        all_ids, all_scores = [], []
+        for term in set(tokenize(query)):
+            ids, term_scores = self._term_scores(term)
+            if ids.size:
+                all_ids.append(ids)
+                all_scores.append(term_scores)
+        if not all_ids:
+            return []
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.zeros(len(ids), dtype=np.float64)
+        np.add.at(scores, inverse, np.concatenate(all_scores))
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return ids[top].tolist()
+
+    def _merge_postings(self, removed: np.ndarray) -> Tuple[List[str], Dict]:
+        """Сохранённые и добавленные постинги одним набором; пустые термы выпадают"""
+        base_alive = ~np.isin(self._base.doc_ids, removed)
+        terms, sizes = [], []
+        doc_ids, tfs = [np.zeros(0, np.int64)], [np.zeros(0, np.int32)]
+        for term in sorted(set(self._base.terms) | set(self._added)):
+            rows, _ = self._base.term(term)
+            alive = base_alive[rows]
+            added_ids, added_tfs = self._added_postings(term)
+            size = int(alive.sum()) + added_ids.size
+            if size:
+                terms.append(term)
+                sizes.append(size)
+                doc_ids += [np.asarray(self._base.doc_ids[rows])[alive], added_ids]
+                tfs += [np.asarray(self._base.tfs[rows])[alive], added_tfs]
+        arrays = {
+            "offsets": np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+            "doc_ids": np.concatenate(doc_ids),
+            "tfs": np.concatenate(tfs).astype(np.int32),
+        }
+        return terms, arrays
+
+    def _merge_lens(self, removed: np.ndarray) -> Dict[str, np.ndarray]:
+        alive = ~np.isin(self._base.len_ids, removed)
+        added_ids = np.array(sorted(self._added_lens), dtype=np.int64)
+        added_lens = [self._added_lens[i] for i in added_ids.tolist()]
+        len_ids = np.concatenate([np.asarray(self._base.len_ids)[alive], added_ids])
+        lens = np.concatenate(
+            [np.asarray(self._base.lens)[alive], np.array(added_lens, dtype=np.int32)]
+        )
+        order = np.argsort(len_ids, kind="stable")
+        return {"len_ids": len_ids[order], "lens": lens[order].astype(np.int32)}
+
+    def save(self, path: str):
+        """Слить изменения с сохранёнными постингами и переоткрыть через mmap"""
+        removed = np.fromiter(self._removed, dtype=np.int64)
+        terms, arrays = self._merge_postings(removed)
+        arrays.update(self._merge_lens(removed))
+        files = self._files(path)
+        for name, array in arrays.items():
+            with open(files[name] + ".tmp", "wb") as f:
+                np.save(f, array)
+        with open(files["meta"] + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"terms": terms, "total_len": self._total_len}, f)
+        for name in files.values():
+            os.replace(name + ".tmp", name)
+        self._open(path)
@@ -0,0 +1,20 @@
+import hashlib
+import json
+
+from common.cache import AsyncCache, LRUCache, normalize_query
+
+
+class AnswerCache(AsyncCache):
+    """
+    Готовые ответы RAG. Ключ - нормализованный вопрос, текст контекста,
+    модель и версия шаблона промпта: другой контекст - другой ответ.
+    По тексту, а не по id чанков: новая версия индекса выдаёт id заново.
+    """
+
+    def __init__(self, backend=None):
+        super().__init__(backend if backend is not None else LRUCache(1000, ttl=3600))
+
+    @staticmethod
+    def key(query: str, context: str, model_uri: str, version: int) -> str:
+        raw = json.dumps([normalize_query(query), context, model_uri, version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -0,0 +1,162 @@
+import json
+import mmap
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+# одна запись на чанк: текст лежит в общем блобе по смещению
+RECORD_DTYPE = np.dtype(
+    [
+        ("id", "<i8"),
+        ("offset", "<i8"),
+        ("length", "<i4"),
+        ("source", "<i4"),
+        ("page", "<i4"),  # 0 - документ без страниц
+    ]
+)
+
+
+@dataclass(slots=True)
+class Chunk:
+    """Чанк, собранный по id из записи и блоба"""
+
+    id: int
+    source: str
+    content: str
+    page: int = 0
+
+    def __repr__(self):
+        return f"Chunk({self.id}, {self.source!r}, {self.content[:30]!r})"
+
+
+class ChunkStore:
+    """
+    Метаданные чанков без pickle: текст одним блобом, массив записей
+    (id, смещение, длина, источник, страница) и таблица источников. Сохранённая часть
+    открывается через mmap и читается по требованию - страницы общие для
+    всех процессов. Изменения копятся в памяти до save().
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        # сохранённая часть: записи (отсортированы по id) и блоб текста;
+        # меняются одной парой, чтобы читатель не увидел их вперемешку
+        self._base: Tuple[np.ndarray, bytes] = (np.zeros(0, RECORD_DTYPE), b"")
+        self._sources: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self._added: Dict[int, Tuple[int, str, int]] = {}
+        self._removed: Set[int] = set()  # только id из сохранённой части
+        self.next_id = 0
+        if path and self.exists(path):
+            self._open(path)
+
+    @staticmethod
+    def _files(path: str) -> Tuple[str, str, str]:
+        return f"{path}.bin", f"{path}.idx.npy", f"{path}.json"
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return all(os.path.exists(f) for f in cls._files(path))
+
+    def _open(self, path: str):
+        blob_path, idx_path, meta_path = self._files(path)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        records = np.load(idx_path, mmap_mode="r")
+        if records.dtype != RECORD_DTYPE:
+            raise ValueError(f"Неизвестный формат {idx_path}")
+        blob = b""
+        if os.path.getsize(blob_path):
+            with open(blob_path, "rb") as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._base = (records, blob)
+        self._sources = meta["sources"]
+        self._source_ids = {s: n for n, s in enumerate(self._sources)}
+        self._added = {}
+        self._removed = set()
+        self.next_id = meta["next_id"]
+
+    @staticmethod
+    def _row(records: np.ndarray, chunk_id: int) -> int:
+        ids = records["id"]
+        row = int(np.searchsorted(ids, chunk_id))
+        if row < len(ids) and ids[row] == chunk_id:
+            return row
+        return -1
+
+    def __contains__(self, chunk_id: int) -> bool:
+        if chunk_id in self._added:
+            return True
+        return chunk_id not in self._removed and self._row(self._base[0], chunk_id) >= 0
+
+    def __len__(self) -> int:
+        return len(self._base[0]) - len(self._removed) + len(self._added)
+
+    def get(self, chunk_id: int) -> Optional[Chunk]:
+        added = self._added.get(chunk_id)
+        if added is not None:
+            return Chunk(chunk_id, self._sources[added[0]], added[1], added[2])
+        if chunk_id in self._removed:
+            return None
+        records, blob = self._base
+        row = self._row(records, chunk_id)
+        if row < 0:
+            return None
+        _, offset, length, source, page = records[row].tolist()
+        text = blob[offset : offset + length].decode("utf-8")
+        return Chunk(chunk_id, self._sources[source], text, page)
+
+    def add(self, chunk_id: int, source: str, content: str, page: int = 0):
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            source_id = self._source_ids[source] = len(self._sources)
+            self._sources.append(source)
+        self._added[chunk_id] = (source_id, content, page)
+        self.next_id = max(self.next_id, chunk_id + 1)
+
+    def remove(self, chunk_id: int):
+        if self._added.pop(chunk_id, None) is not None:
+            return
+        if chunk_id not in self._removed and self._row(self._base[0], chunk_id) >= 0:
+            self._removed.add(chunk_id)
+
+    def __iter__(self) -> Iterator[Chunk]:
+        for chunk_id in self._base[0]["id"].tolist():
+            if chunk_id not in self._removed:
+                yield self.get(chunk_id)
+        for chunk_id in sorted(self._added):
+            yield self.get(chunk_id)
+
+    def save(self, path: Optional[str] = None):
+        """Переписать файлы (удалённые выпадают) и переоткрыть их через mmap"""
+        path = path or self.path
+        blob_path, idx_path, meta_path = self._files(path)
+        records = np.zeros(len(self), dtype=RECORD_DTYPE)
+        offset = 0
+        with open(blob_path + ".tmp", "wb") as f:
+            for n, chunk in enumerate(self):
+                data = chunk.content.encode("utf-8")
+                f.write(data)
+                records[n] = (
+                    chunk.id,
+                    offset,
+                    len(data),
+                    self._source_ids[chunk.source],
+                    chunk.page,
+                )
+                offset += len(data)
+        with open(idx_path + ".tmp", "wb") as f:
+            np.save(f, records)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"sources": self._sources, "next_id": self.next_id},
+                f,
+                ensure_ascii=False,
+            )
+        # старые mmap остаются валидными до закрытия, читатели не ломаются
+        for name in (blob_path, idx_path, meta_path):
+            os.replace(name + ".tmp", name)
+        self.path = path
+        self._open(path)
@@ -0,0 +1,199 @@
+import abc
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EmbedderConfig:
+    """Модель эмбеддингов и параметры инференса"""
+
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
+    backend: str = "torch"  # torch | onnx
+    batch_size: int = 64
+    num_threads: int = 0  # 0 - как решит библиотека
+    # для onnx: файл в репозитории модели; квантованный int8 по умолчанию
+    onnx_file: str = "onnx/model_quint8_avx2.onnx"
+    max_seq_length: int = 256
+
+
+class Embedder(abc.ABC):
+    """Батчевый энкодер: сортировка по длине, явный размер батча, прогресс"""
+
+    def __init__(self, config: EmbedderConfig):
+        self.config = config
+
+    def encode(self, texts: List[str], batch_size: int = 0) -> np.ndarray:
+        batch_size = batch_size or self.config.batch_size
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        # тексты близкой длины в одном батче - меньше паддинга
+        order = np.argsort([len(t) for t in texts])
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        started = last_report = time.monotonic()
+        for start in range(0, len(texts), batch_size):
+            idx = order[start : start + batch_size]
+            out[idx] = self._encode_batch([texts[i] for i in idx])
+            now = time.monotonic()
+            if len(texts) > batch_size and now - last_report > 10:
+                last_report = now
+                done = min(start + batch_size, len(texts))
+                logger.info(
+                    "Эмбеддинги: %d/%d, %.0f текстов/с",
+                    done,
+                    len(texts),
+                    done / (now - started),
+                )
+        return out
+
+    @property
+    @abc.abstractmethod
+    def dim(self) -> int: ...
+
+    @abc.abstractmethod
+    def _encode_batch(self, texts: List[str]) -> np.ndarray: ...
+
+
+class TorchEmbedder(Embedder):
+    """SentenceTransformer на PyTorch (как раньше)"""
+
+    def __init__(self, config: EmbedderConfig):
+        super().__init__(config)
+        # torch грузится лениво: бот с backend=onnx стартует без него
+        # pylint: disable=import-outside-toplevel
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if config.num_threads:
+            torch.set_num_threads(config.num_threads)
+        self.model = SentenceTransformer(config.model_name)
+        self.model.max_seq_length = config.max_seq_length
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, batch_size=len(texts), convert_to_numpy=True
+        ).astype(np.float32)
+
+
+class OnnxEmbedder(Embedder):
+    """
+    ONNX Runtime без torch: токенизатор + mean pooling + L2-нормализация,
+    как в пайплайне all-MiniLM-L6-v2. Нужен extra [onnx].
+    """
+
+    def __init__(self, config: EmbedderConfig):
+        super().__init__(config)
+        try:
+            # pylint: disable=import-outside-toplevel
+            import onnxruntime as ort
+            from huggingface_hub import hf_hub_download
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "Для backend=onnx установите onnxruntime, tokenizers, huggingface-hub"
+            ) from e
+
+        self.tokenizer = Tokenizer.from_file(
+            hf_hub_download(config.model_name, "tokenizer.json")
+        )
+        self.tokenizer.enable_truncation(config.max_seq_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if config.num_threads:
+            options.intra_op_num_threads = config.num_threads
+        self.session = ort.InferenceSession(
+            hf_hub_download(config.model_name, config.onnx_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        self._dim = self.session.get_outputs()[0].shape[-1]
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        feed = {k: v for k, v in feed.items() if k in self._inputs}
+        hidden = self.session.run(None, feed)[0]
+        mask = feed["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class LazyEmbedder(Embedder):
+    """Модель грузится при первом обращении: бот стартует без torch"""
+
+    def __init__(self, config: EmbedderConfig):
+        super().__init__(config)
+        self._impl = None
+        self._lock = threading.Lock()
+
+    @property
+    def impl(self) -> Embedder:
+        if self._impl is None:
+            with self._lock:
+                if self._impl is None:
+                    self._impl = make_embedder(self.config)
+        return self._impl
+
+    @property
+    def dim(self) -> int:
+        return self.impl.dim
+
+    def encode(self, texts: List[str], batch_size: int = 0) -> np.ndarray:
+        return self.impl.encode(texts, batch_size)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.impl.encode(texts, len(texts))
+
+
+def make_embedder(config: EmbedderConfig) -> Embedder:
+    if config.backend == "onnx":
+        return OnnxEmbedder(config)
+    if config.backend == "torch":
+        return TorchEmbedder(config)
+    raise ValueError(f"Неизвестный backend эмбеддингов: {config.backend}")
+
+
+# -----------------------------
+# Сверка бэкендов: косинусная близость и совпадение top-k
+# -----------------------------
+def check_parity(
+    reference: Embedder, candidate: Embedder, texts: List[str], k=10
+) -> Dict:
+    a = reference.encode(texts)
+    b = candidate.encode(texts)
+    a_n = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b_n = b / np.linalg.norm(b, axis=1, keepdims=True)
+    cos = (a_n * b_n).sum(axis=1)
+
+    k = min(k, len(texts))
+    top_a = np.argsort(-(a_n @ a_n.T), axis=1)[:, :k]
+    top_b = np.argsort(-(b_n @ b_n.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)])
+    return {
+        "cos_min": float(cos.min()),
+        "cos_mean": float(cos.mean()),
+        "topk_overlap": float(overlap),
+    }
@@ -0,0 +1,145 @@
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HnswConfig:
+    m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    # HNSW не удаляет вектора: при такой доле удалённых граф пересобирается
+    max_dead_share: float = 0.2
+
+
+@dataclass
+class IvfPqConfig:
+    nlist: int = 0  # 0 - подобрать по размеру обучающей выборки
+    pq_m: int = 48  # должно делить размерность (384 / 48 = 8)
+    pq_nbits: int = 8
+    nprobe: int = 16
+    train_size: int = 50000
+
+
+@dataclass
+class IndexConfig:
+    """Тип FAISS-индекса и параметры каждого типа"""
+
+    index_type: str = "flat"  # flat | hnsw | ivfpq
+    hnsw: HnswConfig = field(default_factory=HnswConfig)
+    ivfpq: IvfPqConfig = field(default_factory=IvfPqConfig)
+
+
+def _ivfpq_nlist(cfg: IvfPqConfig, n: int) -> int:
+    """Число центроидов IVF для n векторов; 0 - на обучение их не хватит"""
+    n = min(n, cfg.train_size)
+    nlist = cfg.nlist or max(1, min(int(4 * math.sqrt(n)), n // 39))
+    # k-means для PQ и IVF нужно ~39 точек на центроид
+    return nlist if n >= max(nlist, 2**cfg.pq_nbits) * 39 else 0
+
+
+def can_train(cfg: IndexConfig, n: int) -> bool:
+    """Хватит ли n векторов, чтобы make_index построил индекс cfg.index_type"""
+    return cfg.index_type != "ivfpq" or _ivfpq_nlist(cfg.ivfpq, n) > 0
+
+
+def make_index(dim: int, cfg: IndexConfig, vecs: np.ndarray) -> faiss.IndexIDMap2:
+    """
+    Создать (и обучить на выборке из vecs) индекс с поддержкой id.
+    IVF-PQ при нехватке векторов заменяется flat, см. can_train.
+    """
+    if cfg.index_type == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{cfg.hnsw.m},Flat")
+        faiss.downcast_index(index).hnsw.efConstruction = cfg.hnsw.ef_construction
+    elif cfg.index_type == "ivfpq":
+        ivfpq = cfg.ivfpq
+        nlist = _ivfpq_nlist(ivfpq, len(vecs))
+        if not nlist:
+            logger.warning(
+                "Слишком мало векторов (%d) для IVF-PQ, используется flat", len(vecs)
+            )
+            return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        n = min(len(vecs), ivfpq.train_size)
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{ivfpq.pq_m}x{ivfpq.pq_nbits}")
+        sample = vecs[np.random.default_rng(0).choice(len(vecs), n, replace=False)]
+        index.train(sample)
+    elif cfg.index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    else:
+        raise ValueError(f"Неизвестный тип индекса: {cfg.index_type}")
+    index = faiss.IndexIDMap2(index)
+    tune_index(index, cfg)
+    return index
+
+
+def tune_index(index: faiss.Index, cfg: IndexConfig):
+    """Параметры поиска (efSearch / nprobe) - не сохраняются в файле индекса"""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if hasattr(inner, "hnsw"):
+        inner.hnsw.efSearch = cfg.hnsw.ef_search
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.nprobe = cfg.ivfpq.nprobe
+
+
+# -----------------------------
+# Отчёт recall@k / латентность относительно flat
+# -----------------------------
+def _label(cfg: IndexConfig) -> str:
+    if cfg.index_type == "hnsw":
+        return f"hnsw(ef={cfg.hnsw.ef_search})"
+    if cfg.index_type == "ivfpq":
+        return f"ivfpq(nprobe={cfg.ivfpq.nprobe})"
+    return cfg.index_type
+
+
+def _search_ms(index: faiss.Index, queries: np.ndarray, k: int):
+    """(найденные id, мс на запрос)"""
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    return found, (time.perf_counter() - started) * 1000 / len(queries)
+
+
+def _measure(
+    cfg: IndexConfig, vecs: np.ndarray, queries: np.ndarray, truth: np.ndarray
+) -> Dict:
+    started = time.perf_counter()
+    index = make_index(vecs.shape[1], cfg, vecs)
+    index.add_with_ids(vecs, np.arange(len(vecs), dtype=np.int64))
+    build_s = time.perf_counter() - started
+
+    found, ms = _search_ms(index, queries, truth.shape[1])
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return {
+        "index": _label(cfg),
+        "recall": hits / truth.size,
+        "ms_per_query": ms,
+        "build_s": build_s,
+    }
+
+
+def compare_indexes(
+    vecs: np.ndarray, queries: np.ndarray, configs: List[IndexConfig], k=10
+) -> List[Dict]:
+    flat = faiss.IndexFlatL2(vecs.shape[1])
+    flat.add(vecs)
+    truth, flat_ms = _search_ms(flat, queries, k)
+
+    report = [{"index": "flat", "recall": 1.0, "ms_per_query": flat_ms}]
+    report.extend(_measure(cfg, vecs, queries, truth) for cfg in configs)
+    for row in report:
+        logger.info(
+            "%-16s recall@%d=%.3f %.3f ms/query",
+            row["index"],
+            k,
+            row["recall"],
+            row["ms_per_query"],
+        )
+    return report
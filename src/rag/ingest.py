@@ -0,0 +1,233 @@
+import logging
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import fitz
+
+from common.tokens import estimate_token_counts
+
+logger = logging.getLogger(__name__)
+
+# Лёгкий модуль без torch/faiss: его импортируют процессы-воркеры извлечения
+
+
+# -----------------------------
+# 2. Извлечь текст (PDF с сохранением структуры)
+# -----------------------------
+def extract_text(path: str, pages: Optional[Tuple[int, int]] = None) -> str:
+    p = Path(path)
+    if p.suffix.lower() == ".txt":
+        return p.read_text(encoding="utf-8", errors="ignore")
+    if p.suffix.lower() == ".pdf":
+        text = []
+        try:
+            doc = fitz.open(path)
+            start, end = pages if pages else (0, doc.page_count)
+            for i in range(start, end):
+                page = doc[i]
+                # blocks сохраняют более связный текст
+                page_text = page.get_text("blocks")
+                if not page_text:
+                    page_text = page.get_text("text")
+                # каждый блок — tuple (x0, y0, x1, y1, text, block_no, ...);
+                # пустая строка между блоками - граница для чанкера
+                if isinstance(page_text, list):
+                    blocks_text = "\n\n".join(b[4] for b in page_text if len(b) > 4)
+                else:
+                    blocks_text = page_text
+                text.append(f"[PAGE {i + 1}]\n{blocks_text}")
+        except Exception as e:
+            logger.error("Ошибка PDF %s: %s", path, e)
+        return "\n".join(text)
+    return ""
+
+
+# -----------------------------
+# 3. Чанкование
+# -----------------------------
+PAGE_RE = re.compile(r"^\[PAGE (\d+)\]$", re.MULTILINE)
+BLOCK_RE = re.compile(r"\n\s*\n")
+SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+
+# тексты -> число токенов в каждом
+TokenCounter = Callable[[List[str]], List[int]]
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# окно MiniLM 256 токенов, два из них - [CLS] и [SEP]
+DEFAULT_MAX_TOKENS = 254
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model_name: str = DEFAULT_MODEL) -> TokenCounter:
+    """Счётчик токенов токенизатора модели (один на процесс)"""
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_pretrained(model_name)
+    except Exception as e:
+        logger.warning("Токенизатор %s недоступен (%s), оценка по длине", model_name, e)
+        # с запасом: wordpiece дробит русские слова на 2-4 токена
+        return estimate_token_counts
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+
+    def count(texts: List[str]) -> List[int]:
+        encodings = tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [len(e.ids) for e in encodings]
+
+    return count
+
+
+def _split_pages(text: str) -> List[Tuple[int, str]]:
+    """Текст с маркерами [PAGE n] -> (страница, текст); 0 - без страниц"""
+    parts = PAGE_RE.split(text)
+    pages = [(0, parts[0])] if parts[0].strip() else []
+    pages.extend((int(n), body) for n, body in zip(parts[1::2], parts[2::2]))
+    return pages
+
+
+def _split_long(unit: str, max_tokens: int, count: TokenCounter) -> List[str]:
+    """Блок длиннее лимита - по предложениям, предложение - по словам"""
+    sentences = SENTENCE_RE.split(unit)
+    if len(sentences) > 1:
+        return [
+            part
+            for sentence, n in zip(sentences, count(sentences))
+            for part in (
+                [sentence]
+                if n <= max_tokens
+                else _split_long(sentence, max_tokens, count)
+            )
+        ]
+    words = unit.split()
+    if len(words) <= 1:
+        return words
+    lengths = count(words)
+    parts, current, size = [], [], 0
+    for word, n in zip(words, lengths):
+        if current and size + n > max_tokens:
+            parts.append(" ".join(current))
+            current, size = [], 0
+        current.append(word)
+        size += n
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    count: Optional[TokenCounter] = None,
+) -> List[Tuple[int, str]]:
+    """
+    Чанки (страница, текст) не длиннее max_tokens токенов модели. Режем по
+    страницам, внутри - по блокам, длинные блоки - по предложениям. Чанк не
+    пересекает границу страницы, перекрытия нет.
+    """
+    count = count or get_token_counter()
+    chunks = []
+    for page, body in _split_pages(text):
+        blocks = [" ".join(b.split()) for b in BLOCK_RE.split(body)]
+        blocks = [b for b in blocks if b]
+        if not blocks:
+            continue
+        units = []
+        for block, n in zip(blocks, count(blocks)):
+            if n <= max_tokens:
+                units.append((block, n, "\n"))
+            else:
+                parts = _split_long(block, max_tokens, count)
+                units.extend(
+                    (part, n, " " if k else "\n")
+                    for k, (part, n) in enumerate(zip(parts, count(parts)))
+                )
+
+        current, size = "", 0
+        for unit, n, sep in units:
+            if current and size + n > max_tokens:
+                chunks.append((page, current))
+                current, size = "", 0
+            current = current + sep + unit if current else unit
+            size += n
+        if current:
+            chunks.append((page, current))
+    return chunks
+
+
+# -----------------------------
+# Параллельный пайплайн: извлечение + чанкование в пуле процессов
+# -----------------------------
+def _extract_chunks(
+    path: str, pages: Optional[Tuple[int, int]], model_name: str, max_tokens: int
+) -> List[Tuple[int, str]]:
+    return chunk_text(
+        extract_text(path, pages), max_tokens, get_token_counter(model_name)
+    )
+
+
+def _split_tasks(path: str, pages_per_task: int) -> List[Optional[Tuple[int, int]]]:
+    """Большие PDF режем на диапазоны страниц, остальное - целиком"""
+    if Path(path).suffix.lower() != ".pdf":
+        return [None]
+    try:
+        with fitz.open(path) as doc:
+            n = doc.page_count
+    except Exception:
+        return [None]
+    ranges = [(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)]
+    return ranges or [None]
+
+
+def _result(key: str, future) -> List[Tuple[int, str]]:
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error("Ошибка извлечения %s: %s", key, e)
+        return []
+
+
+def iter_document_chunks(
+    local_files: Dict[str, str],
+    workers: Optional[int] = None,
+    pages_per_task=50,
+    model_name: str = DEFAULT_MODEL,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+) -> Iterator[Tuple[str, List[Tuple[int, str]]]]:
+    """
+    Отдаёт (key, [(страница, чанк)]) по мере готовности, сохраняя порядок
+    документов и страниц. Один документ может прийти несколькими порциями подряд.
+    """
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    tasks = [
+        (key, path, pages)
+        for key, path in local_files.items()
+        for pages in _split_tasks(path, pages_per_task)
+    ]
+    if workers == 1 or len(tasks) == 1:
+        # пул процессов не окупится
+        for key, path, pages in tasks:
+            yield key, _extract_chunks(path, pages, model_name, max_tokens)
+        return
+
+    # spawn: fork процесса с уже загруженным torch может зависнуть
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # держим ограниченное окно задач, чтобы весь корпус не копился в памяти
+        window = deque()
+        for key, path, pages in tasks:
+            future = pool.submit(_extract_chunks, path, pages, model_name, max_tokens)
+            window.append((key, future))
+            if len(window) >= workers * 2:
+                key_done, future = window.popleft()
+                yield key_done, _result(key_done, future)
+        while window:
+            key_done, future = window.popleft()
+            yield key_done, _result(key_done, future)
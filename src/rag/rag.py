@@ -1,206 +1,821 @@
-import os
-import re
+import asyncio
+import contextlib
+import contextvars
+import json
 import logging
-import tempfile
-import boto3
+import os
+import shutil
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
 import faiss
-import pickle
-import fitz
-from pathlib import Path
-from typing import List, Tuple, Dict
-from sentence_transformers import SentenceTransformer
+import numpy as np
 
-logger = logging.getLogger(__name__)
+from common.cache import LRUCache, normalize_query
+from common.tokens import estimate_tokens
+
+from .bm25 import BM25Index, RetrievalConfig, reciprocal_rank_fusion
+from .cache import AnswerCache
+from .chunk_store import Chunk, ChunkStore
+from .embedding import Embedder, EmbedderConfig, LazyEmbedder
+from .faiss_index import IndexConfig, can_train, make_index, tune_index
+from .ingest import iter_document_chunks
+from .s3 import download_objects, list_s3_objects, prune_cache, s3_client
 
+logger = logging.getLogger(__name__)
 
-# файл делался Женей, ему не нравится использовать линтер, так что он выключен для этого файла в [конфиге](.pylintrc)
-# все вопросы к Жене, все равно я этот файл трогать не буду)))
+# эмбеддинг запроса - CPU-bound, выносим из event loop в отдельный пул
+EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-embed")
 
 
 # -----------------------------
-# 1. Скачать документы из S3
+# 1-3. Скачать документы из S3 - в s3.py, извлечь текст и нарезать - в ingest.py
 # -----------------------------
-def download_from_s3(endpoint, access_key, secret_key, bucket, prefix="") -> List[str]:
-    s3 = boto3.client(
-        "s3",
-        endpoint_url=endpoint,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name="ru-central1",
-    )
-    try:
-        resp = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    except Exception as e:
-        logger.error("Ошибка подключения к S3: %s", e)
-        return []
-
-    if "Contents" not in resp:
-        return []
-
-    local_files = []
-    tmpdir = tempfile.mkdtemp(prefix="rag_s3_")
-    for obj in resp["Contents"]:
-        key = obj.get("Key")
-        if not key or key.endswith("/"):
-            continue
-        size = obj.get("Size", 0)
-        if size == 0:
-            continue
-
-        local_path = os.path.join(tmpdir, os.path.basename(key))
-        try:
-            s3.download_file(bucket, key, local_path)
-            if os.path.getsize(local_path) > 0:
-                local_files.append(local_path)
-        except Exception as e:
-            logger.error("Ошибка скачивания %s: %s", key, e)
-            continue
-
-    return local_files
 
 
 # -----------------------------
-# 2. Извлечь текст (PDF с сохранением структуры)
+# 4. Vector Store (FAISS)
 # -----------------------------
-def extract_text(path: str) -> str:
-    p = Path(path)
-    if p.suffix.lower() == ".txt":
-        return p.read_text(encoding="utf-8", errors="ignore")
-    if p.suffix.lower() == ".pdf":
-        text = []
-        try:
-            doc = fitz.open(path)
-            for i, page in enumerate(doc, start=1):
-                # blocks сохраняют более связный текст
-                page_text = page.get_text("blocks")
-                if not page_text:
-                    page_text = page.get_text("text")
-                # каждый блок — tuple (x0, y0, x1, y1, text, block_no, ...)
-                if isinstance(page_text, list):
-                    blocks_text = "\n".join(b[4] for b in page_text if len(b) > 4)
-                else:
-                    blocks_text = page_text
-                text.append(f"[PAGE {i}]\n{blocks_text}")
-        except Exception as e:
-            logger.error("Ошибка PDF %s: %s", path, e)
-        return "\n".join(text)
-    else:
-        return ""
+@dataclass
+class StoreConfig:
+    """Модель эмбеддингов, тип индекса и параметры поиска VectorStore"""
 
+    embedder: EmbedderConfig = field(default_factory=EmbedderConfig)
+    index: IndexConfig = field(default_factory=IndexConfig)
+    retrieval: RetrievalConfig = field(default_factory=RetrievalConfig)
+    query_cache_size: int = 1024
 
-# -----------------------------
-# 3. Чанкование
-# -----------------------------
-def chunk_text(text: str, max_chars=1800, overlap=250) -> List[str]:
-    chunks, i, n = [], 0, len(text)
-    while i < n:
-        j = min(i + max_chars, n)
-        chunk = text[i:j]
-        chunks.append(chunk)
-        i = j - overlap if j < n else n
-    return chunks
 
+# индекс, чанки, BM25 и кэши выдачи меняются вместе с поколением индекса
+class VectorStore:  # pylint: disable=too-many-instance-attributes
+    """
+    FAISS-индекс, чанки и BM25 в каталоге directory (файлы - artifact_paths).
+    embedder задаётся снаружи, чтобы поколения индекса делили одну модель.
+    """
 
-# -----------------------------
-# 4. Vector Store (FAISS)
-# -----------------------------
-class VectorStore:
     def __init__(
         self,
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        index_path="faiss_index.bin",
-        meta_path="faiss_meta.pkl",
+        directory=".",
+        config: Optional[StoreConfig] = None,
+        embedder: Optional[Embedder] = None,
+        read_only=False,
+        metrics=None,
     ):
-        self.model = SentenceTransformer(model_name)
-        self.index_path = index_path
-        self.meta_path = meta_path
+        self.config = config or StoreConfig()
+        # модель общая для всех поколений индекса и грузится при первом запросе
+        self.embedder = embedder or LazyEmbedder(self.config.embedder)
+        self.paths = artifact_paths(directory)
+        # read_only: вектора flat/HNSW читаются из файла через mmap (IO_FLAG_MMAP_IFC),
+        # их страницы общие для реплик на хосте; граф HNSW грузится в память
+        self.read_only = read_only
+        self.version: Optional[str] = None
+        # gpt.metrics.Metrics или None - без замеров
+        self.metrics = metrics
         self.index = None
-        self.metadatas = []
+        # vector id -> чанк; текст читается из mmap по требованию
+        self.chunks = ChunkStore()
+        # лексический индекс по тем же id
+        self.bm25 = self._new_bm25()
+        # вектора, ещё не добавленные в индекс (до создания индекса)
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        # поколение индекса: меняется при любом изменении состава векторов
+        self.generation = 0
+        # нормализованный запрос -> эмбеддинг (от индекса не зависит)
+        self.embedding_cache = LRUCache(self.config.query_cache_size)
+        # (запрос, top_k) -> id выдачи; сбрасывается со сменой поколения
+        self.result_cache = LRUCache(self.config.query_cache_size)
         self._load()
 
+    @property
+    def model_name(self) -> str:
+        return self.embedder.config.model_name
+
+    @property
+    def index_config(self) -> IndexConfig:
+        return self.config.index
+
+    @property
+    def retrieval_config(self) -> RetrievalConfig:
+        return self.config.retrieval
+
     def _load(self):
-        if os.path.exists(self.index_path) and os.path.exists(self.meta_path):
+        index_path, meta_path = self.paths["index_path"], self.paths["meta_path"]
+        if os.path.exists(index_path) and ChunkStore.exists(meta_path):
+            # IO_FLAG_MMAP копирует IndexFlat/HNSW в кучу, mmap даёт только _IFC
+            flags = (
+                faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+                if self.read_only
+                else 0
+            )
             try:
-                self.index = faiss.read_index(self.index_path)
-                with open(self.meta_path, "rb") as f:
-                    self.metadatas = pickle.load(f)
+                index = faiss.read_index(index_path, flags)
+                chunks = ChunkStore(meta_path)
             except Exception:
-                self.index = None
+                return
+            # старый формат (IndexFlatL2) без id не умеет удалять
+            if not isinstance(index, faiss.IndexIDMap2):
+                logger.info("Индекс в старом формате, будет пересобран")
+                return
+            tune_index(index, self.index_config)
+            self.index = index
+            self.chunks = chunks
+            self.bm25 = self._new_bm25(self.paths["bm25_path"])
+            if len(self.bm25) != len(chunks):
+                # индекс собран до появления BM25 - строим по сохранённым чанкам
+                logger.info("Построение BM25 по %d чанкам", len(chunks))
+                self.bm25 = self._new_bm25()
+                for chunk in chunks:
+                    self.bm25.add(chunk.id, chunk.content)
+                if not self.read_only:
+                    self.bm25.save(self.paths["bm25_path"])
+            self._bump_generation()
+        elif os.path.exists(index_path):
+            logger.info("Нет хранилища чанков %s, индекс будет пересобран", meta_path)
+
+    def span(self, stage: str):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.span(stage)
+
+    def _new_bm25(self, path: Optional[str] = None) -> BM25Index:
+        return BM25Index(path, self.retrieval_config.bm25)
+
+    @property
+    def next_id(self) -> int:
+        return self.chunks.next_id
+
+    def _bump_generation(self):
+        self.generation += 1
+        self.result_cache.clear()
+
+    def reset(self):
+        self.index = None
+        self._pending = []
+        self.chunks = ChunkStore()
+        self.bm25 = self._new_bm25()
+        self._bump_generation()
 
     def persist(self):
+        self._flush_pending()
         if self.index is None:
             return
-        faiss.write_index(self.index, self.index_path)
-        with open(self.meta_path, "wb") as f:
-            pickle.dump(self.metadatas, f)
+        if self._needs_rebuild():
+            self._rebuild()
+        # через временный файл: старый мог быть открыт через mmap или жёсткой ссылкой
+        index_path = self.paths["index_path"]
+        faiss.write_index(self.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        self.checkpoint()
 
-    def build(self, docs: List[Tuple[str, Dict]]):
+    def checkpoint(self):
+        """
+        Сбросить накопленные в памяти чанки и постинги BM25 в файлы и
+        переоткрыть их через mmap; при долгой сборке память не растёт с корпусом.
+        """
+        self.chunks.save(self.paths["meta_path"])
+        self.bm25.save(self.paths["bm25_path"])
+
+    def add(self, docs: List[Tuple[str, Dict]]) -> Tuple[int, int]:
+        """Добавить чанки, вернуть диапазон выданных id [start, end)"""
+        start = self.next_id
+        if not docs:
+            return start, start
         texts = [t for t, _ in docs]
-        vecs = self.model.encode(texts, convert_to_numpy=True)
+        vecs = self.embedder.encode(texts)
+        ids = np.arange(start, start + len(docs), dtype=np.int64)
+        for i, (text, m) in zip(ids.tolist(), docs):
+            self.chunks.add(i, m["source"], text, m.get("page", 0))
+            self.bm25.add(i, text)
+
+        # IVF-PQ обучается на выборке: копим вектора, пока её не наберём;
+        # flat и HNSW обучения не требуют и получают вектора сразу
+        self._pending.append((vecs, ids))
+        pending = sum(len(v) for v, _ in self._pending)
+        if (
+            self.index is not None
+            or self.index_config.index_type != "ivfpq"
+            or pending >= self.index_config.ivfpq.train_size
+        ):
+            self._flush_pending()
+        return start, self.next_id
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        vecs = np.concatenate([v for v, _ in self._pending])
+        ids = np.concatenate([i for _, i in self._pending])
+        self._pending = []
         if self.index is None:
-            self.index = faiss.IndexFlatL2(vecs.shape[1])
-        self.index.add(vecs)
-        self.metadatas.extend([m for _, m in docs])
+            self.index = make_index(vecs.shape[1], self.index_config, vecs)
+        self.index.add_with_ids(vecs, ids)
+        self._bump_generation()
+
+    def _needs_rebuild(self) -> bool:
+        if self.index_config.index_type == "hnsw":
+            # удалённые остаются в графе и занимают места среди кандидатов
+            dead = self.index.ntotal - len(self.chunks)
+            return dead > self.index_config.hnsw.max_dead_share * self.index.ntotal
+        # IVF-PQ, собранный как flat на малой выборке, обучается, когда векторов хватит
+        return (
+            self.index_config.index_type == "ivfpq"
+            and faiss.try_extract_index_ivf(self.index.index) is None
+            and can_train(self.index_config, self.index.ntotal)
+        )
+
+    def _rebuild(self):
+        """
+        Новый индекс из живых векторов текущего: flat и HNSW хранят их без
+        потерь, эмбеддить заново не нужно.
+        """
+        inner = faiss.downcast_index(self.index.index)
+        ids = faiss.vector_to_array(self.index.id_map)
+        live = np.fromiter((int(i) in self.chunks for i in ids), bool, len(ids))
+        vecs = inner.reconstruct_n(0, inner.ntotal)[live]
+        ids = ids[live]
+        logger.info(
+            "Пересборка индекса %s: %d векторов", self.index_config.index_type, len(ids)
+        )
+        index = make_index(vecs.shape[1], self.index_config, vecs)
+        index.add_with_ids(vecs, ids)
+        self.index = index
+        self._bump_generation()
+
+    def remove(self, ids: List[int]):
+        ids = [i for i in ids if i in self.chunks]
+        if not ids or self.index is None:
+            return
+        try:
+            self.index.remove_ids(np.array(ids, dtype=np.int64))
+        except RuntimeError:
+            # HNSW не умеет удалять: вектора остаются, но без метаданных
+            # не попадают в выдачу; граф пересобирается в persist,
+            # когда их доля превысит hnsw.max_dead_share
+            logger.warning("Индекс не поддерживает удаление, %d id помечены", len(ids))
+        for i in ids:
+            self.chunks.remove(i)
+            self.bm25.remove(i)
+        self._bump_generation()
+
+    def build(self, docs: List[Tuple[str, Dict]]):
+        self.add(docs)
         self.persist()
 
-    def query(self, q: str, top_k=5) -> List[Dict]:
+    def query(self, q: str, top_k=5) -> List[Chunk]:
+        return self.get(self.search(q, top_k))
+
+    def search(self, q: str, top_k=5) -> List[int]:
+        """id лучших чанков по запросу: вектора + BM25 с весами буста"""
         if not self.index:
             return []
-        qv = self.model.encode([q], convert_to_numpy=True)
-        # ищем больше кандидатов, чтобы потом фильтровать
-        D, I = self.index.search(qv, top_k * 3)
-        results = []
-        for i in I[0]:
-            if i < len(self.metadatas):
-                m = self.metadatas[i]
-                if re.search(r"operator|infix", m["content"], re.IGNORECASE):
-                    # приоритет для операторов
-                    results.insert(0, m)
-                else:
-                    results.append(m)
-        return results[:top_k]
+        text = normalize_query(q)
+        generation = self.generation
+        ids = self.result_cache.get((text, top_k))
+        if ids is None:
+            ids = self._search(text, top_k)
+            # индекс мог измениться, пока искали - такую выдачу не кэшируем
+            if generation == self.generation:
+                self.result_cache.put((text, top_k), ids)
+        return [i for i in ids if i in self.chunks]
+
+    def get(self, ids: List[int]) -> List[Chunk]:
+        chunks = [self.chunks.get(i) for i in ids]
+        return [c for c in chunks if c is not None]
+
+    def _search(self, text: str, top_k: int) -> List[int]:
+        qv = self.embedding_cache.get(text)
+        if qv is None:
+            with self.span("embed_query"):
+                qv = self.embedder.encode([text])
+            self.embedding_cache.put(text, qv)
+        cfg = self.retrieval_config
+        candidates = max(cfg.candidates, top_k * 3)
+        with self.span("vector_search"):
+            _, found = self.index.search(qv, candidates)
+        # -1 - не хватило векторов; без чанка - помеченные удалёнными в HNSW
+        vector_ids = [int(i) for i in found[0] if i >= 0 and int(i) in self.chunks]
+        rankings = [(vector_ids, cfg.fusion.vector_weight)]
+        if cfg.hybrid:
+            # точные идентификаторы (имена функций Julia) эмбеддинги ловят плохо
+            with self.span("bm25_search"):
+                bm25_ids = self.bm25.search(text, candidates)
+            rankings.append((bm25_ids, cfg.fusion.bm25_weight))
+        scores = reciprocal_rank_fusion(rankings, cfg.fusion.rrf_k)
+        if not scores:
+            return []
+
+        ids = np.fromiter(scores, dtype=np.int64, count=len(scores))
+        fused = self._boost(
+            ids, np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        )
+        top = np.argsort(-fused, kind="stable")[:top_k]
+        return ids[top].tolist()
+
+    def _boost(self, ids: np.ndarray, fused: np.ndarray) -> np.ndarray:
+        """Умножить оценки чанков с термином буста на его вес"""
+        for term, weight in self.retrieval_config.fusion.boosts.items():
+            fused[np.isin(ids, self.bm25.postings(term)[0])] *= weight
+        return fused
+
+    def cache_stats(self) -> Dict[str, float]:
+        return {
+            "embedding_hit_rate": self.embedding_cache.hit_rate,
+            "result_hit_rate": self.result_cache.hit_rate,
+            "generation": self.generation,
+        }
 
 
 # -----------------------------
-# 5. Подготовить индекс
+# 5. Манифест индекса
 # -----------------------------
-def prepare_index(s3_cfg: Dict) -> VectorStore:
-    files = download_from_s3(**s3_cfg)
-    docs = []
-    for f in files:
-        txt = extract_text(f)
-        for c in chunk_text(txt):
-            docs.append((c, {"source": os.path.basename(f), "content": c}))
-    if not docs:
-        docs = [
-            (
-                "Нет доступных документов.",
-                {"source": "placeholder", "content": "Нет доступных документов."},
+PLACEHOLDER_KEY = "__placeholder__"
+
+
+@dataclass
+class IndexManifest:
+    """Какие документы (по ETag) лежат в индексе и какие id у их чанков"""
+
+    # 2: источник чанка - ключ S3, а не имя файла
+    FORMAT = 2
+
+    path: str
+    model_name: str = ""
+    index_type: str = "flat"
+    # key -> {"etag": str, "ids": [start, end]}
+    documents: Dict[str, Dict] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str, model_name: str, index_type: str) -> "IndexManifest":
+        manifest = cls(path=path, model_name=model_name, index_type=index_type)
+        if not os.path.exists(path):
+            return manifest
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error("Ошибка чтения манифеста %s: %s", path, e)
+            return manifest
+        # другая модель, тип индекса или формат - индекс собирается заново
+        if (
+            data.get("format", 1) == cls.FORMAT
+            and data.get("model_name") == model_name
+            and data.get("index_type", "flat") == index_type
+        ):
+            manifest.documents = data.get("documents", {})
+        return manifest
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "format": self.FORMAT,
+                    "model_name": self.model_name,
+                    "index_type": self.index_type,
+                    "documents": self.documents,
+                },
+                f,
+                ensure_ascii=False,
             )
-        ]
-    vs = VectorStore()
-    vs.build(docs)
+        os.replace(tmp_path, self.path)
+
+    def ids(self, key: str) -> List[int]:
+        start, end = self.documents[key]["ids"]
+        return list(range(start, end))
+
+
+# -----------------------------
+# 6. Подготовить индекс
+# -----------------------------
+@dataclass
+class BuildConfig:
+    """Откуда и как собирать индекс: бакет S3, кэш файлов, размеры пачек"""
+
+    s3: Dict[str, str]
+    cache_dir: str = "rag_cache"
+    workers: Optional[int] = None  # процессов извлечения текста, None - по CPU
+    embed_batch_size: int = 256
+    # через сколько чанков сбрасывать чанки и BM25 на диск
+    checkpoint_every: int = 50000
+    keep: int = 3  # сколько версий хранит build_version
+
+
+def prepare_index(
+    build: BuildConfig,
+    directory=".",
+    config: Optional[StoreConfig] = None,
+    embedder: Optional[Embedder] = None,
+    remote: Optional[Dict[str, str]] = None,
+) -> VectorStore:
+    """
+    Инкрементальная сборка: эмбеддим только новые/изменённые документы.
+    directory - каталог версии индекса (см. build_version), по умолчанию cwd.
+    remote - уже полученный список бакета (key -> ETag).
+    """
+    vs = VectorStore(directory, config, embedder)
+    manifest = IndexManifest.load(
+        vs.paths["manifest_path"], vs.model_name, vs.index_config.index_type
+    )
+    if vs.index is None or not manifest.documents:
+        # индекс и манифест не согласованы - собираем с нуля
+        vs.reset()
+        manifest.documents = {}
+
+    s3 = s3_client(build.s3)
+    if remote is None:
+        remote = list_s3_objects(s3, build.s3["bucket"], build.s3.get("prefix", ""))
+    if remote is None:
+        if vs.index is not None:
+            logger.warning("S3 недоступен, используется существующий индекс")
+            return vs
+        remote = {}
+    else:
+        prune_cache(build.cache_dir, list(remote))
+
+    changed, removed = _diff(manifest, remote)
+    logger.info(
+        "Индекс: %d без изменений, %d новых/изменённых, %d удалённых",
+        len(remote) - len(changed),
+        len(changed),
+        len(removed),
+    )
+    local_files = download_objects(
+        s3, build.s3["bucket"], {k: remote[k] for k in changed}, build.cache_dir
+    )
+    # не скачавшиеся документы остаются в прежнем виде и не попадают
+    # в манифест с новым ETag: следующее обновление попробует их снова
+    for key in removed + list(local_files):
+        if key in manifest.documents:
+            vs.remove(manifest.ids(key))
+            del manifest.documents[key]
+    _ingest(vs, manifest, local_files, remote, build)
+
+    if not vs.chunks:
+        text = "Нет доступных документов."
+        start, end = vs.add([(text, {"source": "placeholder"})])
+        manifest.documents[PLACEHOLDER_KEY] = {"etag": "", "ids": [start, end]}
+
+    vs.persist()
+    manifest.save()
+    return vs
+
+
+def _ingest(
+    vs: VectorStore,
+    manifest: IndexManifest,
+    local_files: Dict[str, str],
+    remote: Dict[str, str],
+    build: BuildConfig,
+):
+    """Нарезать и проэмбеддить скачанные документы, записать их id в манифест"""
+    # чанки идут из пула процессов по мере извлечения и эмбеддятся пачками;
+    # id выдаются подряд, поэтому у каждого документа непрерывный диапазон
+    next_id, batch, unsaved = vs.next_id, [], 0
+    chunk_stream = iter_document_chunks(
+        local_files,
+        workers=build.workers,
+        model_name=vs.model_name,
+        max_tokens=vs.embedder.config.max_seq_length - 2,
+    )
+    for key, chunks in chunk_stream:
+        doc = manifest.documents.setdefault(
+            key, {"etag": remote[key], "ids": [next_id, next_id]}
+        )
+        # ключ, а не имя файла: одинаковые имена в разных папках - разные документы
+        batch.extend((c, {"source": key, "page": page}) for page, c in chunks)
+        next_id += len(chunks)
+        doc["ids"][1] = next_id
+        if len(batch) >= build.embed_batch_size:
+            vs.add(batch)
+            unsaved += len(batch)
+            batch = []
+        if unsaved >= build.checkpoint_every:
+            vs.checkpoint()
+            unsaved = 0
+    vs.add(batch)
+
+    # скачались, но не дали текста: запоминаем ETag с пустым диапазоном,
+    # чтобы _diff не считал их изменёнными при каждом обновлении
+    empty = [k for k in local_files if k not in manifest.documents]
+    for key in empty:
+        manifest.documents[key] = {"etag": remote[key], "ids": [next_id, next_id]}
+    if empty:
+        logger.warning("Пропущено документов без текста: %d", len(empty))
+
+
+def _diff(manifest: IndexManifest, remote: Dict[str, str]) -> Tuple[List, List]:
+    """(новые или изменённые, удалённые) ключи S3 относительно манифеста"""
+    changed = [
+        k
+        for k, etag in remote.items()
+        if manifest.documents.get(k, {}).get("etag") != etag
+    ]
+    removed = [k for k in manifest.documents if k not in remote]
+    return changed, removed
+
+
+# -----------------------------
+# 6б. Версии индекса: rag_index/<версия>/ + указатель CURRENT
+# -----------------------------
+def artifact_paths(directory: str) -> Dict[str, str]:
+    return {
+        "index_path": os.path.join(directory, "faiss_index.bin"),
+        "meta_path": os.path.join(directory, "faiss_chunks"),
+        "bm25_path": os.path.join(directory, "faiss_bm25"),
+        "manifest_path": os.path.join(directory, "faiss_manifest.json"),
+    }
+
+
+def current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version if os.path.isdir(os.path.join(root, version)) else None
+
+
+def current_paths(root: str) -> Optional[Dict[str, str]]:
+    """Пути артефактов текущей версии; None - версия ещё не собрана"""
+    version = current_version(root)
+    if version is None:
+        return None
+    return artifact_paths(os.path.join(root, version))
+
+
+def _set_current(root: str, version: str):
+    tmp_path = os.path.join(root, "CURRENT.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(root, "CURRENT"))
+
+
+def _link_version(src: str, dst: str):
+    """Новая версия начинается с жёстких ссылок на файлы текущей"""
+    for name in os.listdir(src):
+        try:
+            os.link(os.path.join(src, name), os.path.join(dst, name))
+        except OSError:
+            shutil.copy2(os.path.join(src, name), os.path.join(dst, name))
+
+
+def _prune_versions(root: str, keep: int):
+    current = current_version(root)
+    versions = sorted(
+        v for v in os.listdir(root) if os.path.isdir(os.path.join(root, v))
+    )
+    for version in versions[:-keep] if keep else []:
+        if version != current:
+            # открытые через mmap файлы остаются доступны до закрытия
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def _new_version_dir(root: str) -> str:
+    """Создать каталог новой версии: метка времени, при совпадении - суффикс"""
+    version = time.strftime("%Y%m%d-%H%M%S")
+    directory = os.path.join(root, version)
+    suffix = 0
+    while os.path.exists(directory):
+        suffix += 1
+        directory = os.path.join(root, f"{version}.{suffix}")
+    os.makedirs(directory)
+    return directory
+
+
+def build_version(
+    build: BuildConfig,
+    root="rag_index",
+    config: Optional[StoreConfig] = None,
+    embedder: Optional[Embedder] = None,
+) -> Optional[str]:
+    """
+    Собрать новую версию индекса и переключить на неё CURRENT.
+    None - в бакете ничего не поменялось, версия осталась прежней.
+    """
+    os.makedirs(root, exist_ok=True)
+    config = config or StoreConfig()
+    # LazyEmbedder грузит модель только при первом encode
+    embedder = embedder or LazyEmbedder(config.embedder)
+    current = current_version(root)
+    manifest, remote = None, None
+    if current is not None:
+        remote = list_s3_objects(
+            s3_client(build.s3), build.s3["bucket"], build.s3.get("prefix", "")
+        )
+        if remote is None:
+            logger.warning("S3 недоступен, остаётся версия %s", current)
+            return None
+        manifest = IndexManifest.load(
+            artifact_paths(os.path.join(root, current))["manifest_path"],
+            embedder.config.model_name,
+            config.index.index_type,
+        )
+        changed, removed = _diff(manifest, remote)
+        if not changed and removed in ([], [PLACEHOLDER_KEY]):
+            return None
+
+    directory = _new_version_dir(root)
+    if current is not None:
+        _link_version(os.path.join(root, current), directory)
+    try:
+        prepare_index(build, directory, config, embedder, remote)
+    except BaseException:
+        # недособранная версия не должна стать текущей
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    if manifest is not None and _same_documents(manifest, directory):
+        # изменились только документы, которые не удалось скачать
+        logger.warning("Изменённые документы не скачались, остаётся версия %s", current)
+        shutil.rmtree(directory, ignore_errors=True)
+        return None
+    version = os.path.basename(directory)
+    _set_current(root, version)
+    _prune_versions(root, build.keep)
+    logger.info("Новая версия индекса: %s", version)
+    return version
+
+
+def _same_documents(manifest: IndexManifest, directory: str) -> bool:
+    built = IndexManifest.load(
+        artifact_paths(directory)["manifest_path"],
+        manifest.model_name,
+        manifest.index_type,
+    )
+    return built.documents == manifest.documents
+
+
+def open_version(
+    root="rag_index", version: Optional[str] = None, **kwargs
+) -> Optional[VectorStore]:
+    """Открыть версию индекса (по умолчанию CURRENT) только для чтения"""
+    version = version or current_version(root)
+    if version is None:
+        return None
+    vs = VectorStore(os.path.join(root, version), read_only=True, **kwargs)
+    if vs.index is None:
+        logger.error("Версия индекса %s не открывается", version)
+        return None
+    vs.version = version
     return vs
 
 
+class IndexRefresher:
+    """
+    Фоновое обновление индекса без остановки бота: собрать (если задан build)
+    или просто заметить новую версию, открыть её и атомарно подменить
+    target.vector_store. Запросы в работе держат ссылку на старое поколение
+    и дорабатывают на нём; память освобождается, когда они закончатся.
+    """
+
+    def __init__(
+        self,
+        target,
+        root="rag_index",
+        interval=3600.0,
+        build: Optional[Callable[[], Optional[str]]] = None,
+        **store_kwargs,
+    ):
+        self.target = target
+        self.root = root
+        self.interval = interval
+        self.build = build
+        self.store_kwargs = store_kwargs
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Ошибка обновления индекса: %s", e)
+
+    async def refresh(self) -> bool:
+        if self.build is not None:
+            await asyncio.to_thread(self.build)
+        version = current_version(self.root)
+        old = self.target.vector_store
+        if version is None or version == old.version:
+            return False
+        store = await asyncio.to_thread(
+            open_version, self.root, version, **self.store_kwargs
+        )
+        if store is None:
+            return False
+        # присваивание атрибута атомарно для корутин и потоков
+        self.target.vector_store = store
+        weakref.finalize(
+            old, logger.info, "Поколение индекса %s освобождено", old.version
+        )
+        logger.info("Индекс переключён: %s -> %s", old.version, version)
+        return True
+
+
 # -----------------------------
-# 6. Сборка контекста
+# 7. Сборка контекста
 # -----------------------------
-def build_context(results: List[Dict]) -> str:
-    parts = []
+def _join_overlapping(left: str, right: str, max_overlap=400) -> str:
+    """Склеить соседние чанки, убрав повтор на стыке (старый чанкер с overlap)"""
+    for k in range(min(max_overlap, len(left), len(right)), 20, -1):
+        if left.endswith(right[:k]):
+            return left + right[k:]
+    return left + "\n" + right
+
+
+def _shingles(text: str, n=3) -> set:
+    words = text.casefold().split()
+    return {tuple(words[i : i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+@dataclass
+class _Passage:
+    """Подряд идущие чанки одного документа (source - ключ S3)"""
+
+    source: str
+    ids: List[int]
+    pages: List[int]
+    text: str
+
+    def cite(self) -> str:
+        pages = sorted({p for p in self.pages if p})
+        if not pages:
+            return self.source
+        if pages[0] == pages[-1]:
+            return f"{self.source}, стр. {pages[0]}"
+        return f"{self.source}, стр. {pages[0]}-{pages[-1]}"
+
+
+def _merge_adjacent(results: List[Chunk]) -> List[_Passage]:
+    """Соседние по id чанки одного документа - в один фрагмент; порядок - по лучшему"""
+    passages: List[_Passage] = []
     for r in results:
-        parts.append(f"Источник: {r.get('source')}\n{r.get('content')}\n---")
+        for p in passages:
+            if p.source != r.source:
+                continue
+            if r.id == p.ids[-1] + 1:
+                p.ids.append(r.id)
+                p.pages.append(r.page)
+                p.text = _join_overlapping(p.text, r.content)
+                break
+            if r.id == p.ids[0] - 1:
+                p.ids.insert(0, r.id)
+                p.pages.insert(0, r.page)
+                p.text = _join_overlapping(r.content, p.text)
+                break
+        else:
+            passages.append(_Passage(r.source, [r.id], [r.page], r.content))
+    return passages
+
+
+def build_context(
+    results: List[Chunk], max_tokens: int = 0, dedup_threshold: float = 0.8
+) -> str:
+    """
+    Контекст из результатов в порядке релевантности: соседние чанки склеены,
+    почти одинаковые фрагменты выброшены, всё укладывается в max_tokens
+    (0 - без лимита).
+    """
+    parts, seen, used = [], [], 0
+    for passage in _merge_adjacent(results):
+        shingles = _shingles(passage.text)
+        if any(
+            len(shingles & other) / len(shingles | other) >= dedup_threshold
+            for other in seen
+        ):
+            continue
+        part = f"Источник: {passage.cite()}\n{passage.text}\n---"
+        cost = estimate_tokens(part)
+        if max_tokens and used + cost > max_tokens:
+            # следующий, менее релевантный, может оказаться короче
+            continue
+        parts.append(part)
+        seen.append(shingles)
+        used += cost
     return "\n".join(parts)
 
 
 # -----------------------------
-# 7. Основная функция RAG
+# 8. Основная функция RAG
 # -----------------------------
-def rag_answer(vector_store: VectorStore, yandex_bot, query: str, user_id: int) -> str:
-    results = vector_store.query(query, 5)
-    context = build_context(results)
+# менять при любой правке шаблона ниже, иначе кэш ответов отдаст старые
+# (3: кэшируемые ответы генерируются без истории пользователя)
+PROMPT_VERSION = 3
+
+
+def make_rag_prompt(context: str, query: str) -> str:
     # Тут с промптом можно поэкспериментировать
-    final_prompt = (
+    return (
         "[CONTEXT]\n"
         f"{context}\n"
         "[SYSTEM]\n"
@@ -208,4 +823,90 @@ def rag_answer(vector_store: VectorStore, yandex_bot, query: str, user_id: int)
         "[USER]\n"
         f"{query}\n"
     )
-    return yandex_bot.ask_gpt(final_prompt, user_id)
+
+
+def pack_context(vector_store: VectorStore, ids: List[int]) -> str:
+    cfg = vector_store.retrieval_config.context
+    with vector_store.span("pack_context"):
+        return build_context(
+            vector_store.get(ids), cfg.context_tokens, cfg.dedup_threshold
+        )
+
+
+async def retrieve(
+    vector_store: VectorStore, query: str, top_k: Optional[int] = None
+) -> List[int]:
+    top_k = top_k or vector_store.retrieval_config.context.top_k
+    loop = asyncio.get_running_loop()
+    # контекст - чтобы стадии поиска в потоке попали в трассу запроса
+    context = contextvars.copy_context()
+    with vector_store.span("retrieve"):
+        return await loop.run_in_executor(
+            EMBED_EXECUTOR, context.run, vector_store.search, query, top_k
+        )
+
+
+async def build_rag_prompt(vector_store: VectorStore, query: str) -> str:
+    ids = await retrieve(vector_store, query)
+    return make_rag_prompt(pack_context(vector_store, ids), query)
+
+
+def _remember(yandex_bot, user_id: int, prompt: str, answer: str):
+    # история должна выглядеть так же, как после обычного ответа
+    yandex_bot.add_to_history(user_id, "user", prompt)
+    yandex_bot.add_to_history(user_id, "assistant", answer)
+
+
+async def rag_answer(
+    vector_store: VectorStore,
+    yandex_bot,
+    query: str,
+    user_id: int,
+    answer_cache: Optional[AnswerCache] = None,
+) -> str:
+    ids = await retrieve(vector_store, query)
+    context = pack_context(vector_store, ids)
+    final_prompt = make_rag_prompt(context, query)
+    if answer_cache is None:
+        return await yandex_bot.ask_gpt(final_prompt, user_id)
+
+    key = AnswerCache.key(query, context, yandex_bot.model_uri, PROMPT_VERSION)
+    answer = await answer_cache.get(key)
+    if answer is None:
+        # ответ для кэша - без истории пользователя: его получат и другие
+        answer = await yandex_bot.ask_gpt(final_prompt, None)
+        if answer == yandex_bot.refusal_message:
+            return answer
+        await answer_cache.put(key, answer)
+    _remember(yandex_bot, user_id, final_prompt, answer)
+    return answer
+
+
+async def rag_answer_stream(
+    vector_store: VectorStore,
+    yandex_bot,
+    query: str,
+    user_id: int,
+    answer_cache: Optional[AnswerCache] = None,
+) -> AsyncIterator[str]:
+    ids = await retrieve(vector_store, query)
+    context = pack_context(vector_store, ids)
+    final_prompt = make_rag_prompt(context, query)
+    if answer_cache is None:
+        async for answer in yandex_bot.ask_gpt_stream(final_prompt, user_id):
+            yield answer
+        return
+
+    key = AnswerCache.key(query, context, yandex_bot.model_uri, PROMPT_VERSION)
+    answer = await answer_cache.get(key)
+    if answer is not None:
+        _remember(yandex_bot, user_id, final_prompt, answer)
+        yield answer
+        return
+
+    async for answer in yandex_bot.ask_gpt_stream(final_prompt, None):
+        yield answer
+    # в кэш и историю - только полностью полученный ответ, отказ не кэшируется
+    if answer is not None and answer != yandex_bot.refusal_message:
+        await answer_cache.put(key, answer)
+        _remember(yandex_bot, user_id, final_prompt, answer)
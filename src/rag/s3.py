@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_RETRIES = 3
+
+
+def s3_client(s3_cfg: Dict):
+    return boto3.client(
+        "s3",
+        endpoint_url=s3_cfg["endpoint"],
+        aws_access_key_id=s3_cfg["access_key"],
+        aws_secret_access_key=s3_cfg["secret_key"],
+        region_name="ru-central1",
+    )
+
+
+def list_s3_objects(s3, bucket, prefix="") -> Optional[Dict[str, str]]:
+    """key -> ETag для всех непустых объектов; None, если S3 недоступен"""
+    objects = {}
+    try:
+        # list_objects_v2 отдаёт не больше 1000 ключей за запрос
+        for page in s3.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                key = obj.get("Key")
+                if not key or key.endswith("/"):
+                    continue
+                if obj.get("Size", 0) == 0:
+                    continue
+                objects[key] = obj.get("ETag", "").strip('"')
+    except Exception as e:
+        logger.error("Ошибка подключения к S3: %s", e)
+        return None
+    return objects
+
+
+def _cache_path(cache_dir: str, key: str) -> str:
+    # хэш ключа: одинаковые basename из разных префиксов не затирают друг друга,
+    # расширение сохраняем для extract_text
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest + Path(key).suffix.lower())
+
+
+def _fetch(s3, bucket, key: str, etag: str, path: str) -> int:
+    tmp_path = path + ".part"
+    s3.download_file(bucket, key, tmp_path)
+    os.replace(tmp_path, path)
+    with open(path + ".etag", "w", encoding="utf-8") as f:
+        f.write(etag)
+    return os.path.getsize(path)
+
+
+def _download_one(s3, bucket, key: str, etag: str, cache_dir: str):
+    """Скачать объект в кэш, если его там нет с тем же ETag; вернуть (путь, байт)"""
+    path = _cache_path(cache_dir, key)
+    etag_path = path + ".etag"
+    if os.path.exists(path) and os.path.exists(etag_path):
+        with open(etag_path, "r", encoding="utf-8") as f:
+            if f.read() == etag:
+                return path, 0
+
+    for attempt in range(DOWNLOAD_RETRIES - 1):
+        try:
+            return path, _fetch(s3, bucket, key, etag, path)
+        except Exception as e:
+            logger.warning("Повтор скачивания %s (%s)", key, e)
+            time.sleep(0.5 * 2**attempt)
+    # последняя попытка: ошибка уходит в download_objects
+    return path, _fetch(s3, bucket, key, etag, path)
+
+
+@dataclass
+class _Progress:
+    """Счётчики скачивания и лог не чаще раза в 5 секунд"""
+
+    total: int
+    done: int = 0
+    downloaded: int = 0
+    skipped: int = 0
+    bytes: int = 0
+    started: float = field(default_factory=time.monotonic)
+    last_report: float = field(default_factory=time.monotonic)
+
+    def update(self, size: Optional[int]):
+        """size - байт скачано, 0 - взято из кэша, None - ошибка"""
+        self.done += 1
+        if size:
+            self.downloaded += 1
+            self.bytes += size
+        elif size == 0:
+            self.skipped += 1
+        now = time.monotonic()
+        if now - self.last_report > 5 or self.done == self.total:
+            self.last_report = now
+            mb = self.bytes / 2**20
+            logger.info(
+                "S3: %d/%d объектов (%d скачано, %d из кэша), %.1f МБ, %.1f МБ/с",
+                self.done,
+                self.total,
+                self.downloaded,
+                self.skipped,
+                mb,
+                mb / max(now - self.started, 1e-6),
+            )
+
+
+def download_objects(
+    s3, bucket, objects: Dict[str, str], cache_dir: str, workers=8
+) -> Dict[str, str]:
+    """Скачать объекты (key -> ETag) в локальный кэш, вернуть key -> путь"""
+    os.makedirs(cache_dir, exist_ok=True)
+    local_files = {}
+    progress = _Progress(len(objects))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-s3") as pool:
+        futures = {
+            pool.submit(_download_one, s3, bucket, key, etag, cache_dir): key
+            for key, etag in objects.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                path, size = future.result()
+            except Exception as e:
+                logger.error("Ошибка скачивания %s: %s", key, e)
+                progress.update(None)
+                continue
+            local_files[key] = path
+            progress.update(size)
+    return local_files
+
+
+def prune_cache(cache_dir: str, keys: List[str]):
+    """Удалить из кэша файлы объектов, которых больше нет в бакете"""
+    if not os.path.isdir(cache_dir):
+        return
+    keep = {os.path.basename(_cache_path(cache_dir, k)) for k in keys}
+    for name in os.listdir(cache_dir):
+        base = name.removesuffix(".etag").removesuffix(".part")
+        if base not in keep:
+            os.remove(os.path.join(cache_dir, name))
+
+
+def download_from_s3(s3_cfg: Dict, cache_dir="rag_cache") -> List[str]:
+    s3 = s3_client(s3_cfg)
+    objects = list_s3_objects(s3, s3_cfg["bucket"], s3_cfg.get("prefix", ""))
+    if not objects:
+        return []
+    return list(download_objects(s3, s3_cfg["bucket"], objects, cache_dir).values())
@@ -0,0 +1,63 @@
+"""Настройки RAG из окружения: общие для бота и офлайн-сборки индекса"""
+
+import os
+
+from dotenv import load_dotenv
+
+from rag import rag
+from rag.bm25 import ContextConfig, RetrievalConfig, parse_boosts
+from rag.embedding import EmbedderConfig
+from rag.faiss_index import HnswConfig, IndexConfig, IvfPqConfig
+
+load_dotenv()
+
+s3_cfg = {
+    "endpoint": os.environ["S3_ENDPOINT"],
+    "access_key": os.environ["S3_ACCESS_KEY"],
+    "secret_key": os.environ["S3_SECRET_KEY"],
+    "bucket": os.environ["S3_BUCKET"],
+    "prefix": os.environ.get("S3_PREFIX", ""),
+}
+
+RAG_CACHE_DIR = os.environ.get("RAG_CACHE_DIR", "rag_cache")
+RAG_INGEST_WORKERS = int(os.environ.get("RAG_INGEST_WORKERS", "0")) or None
+RAG_INDEX_DIR = os.environ.get("RAG_INDEX_DIR", "rag_index")
+RAG_INDEX_KEEP = int(os.environ.get("RAG_INDEX_KEEP", "3"))
+RAG_REFRESH_INTERVAL = float(os.environ.get("RAG_REFRESH_INTERVAL", "3600"))
+# 1 - бот сам пересобирает индекс, 0 - только подхватывает версии build_index.py
+RAG_REFRESH_BUILD = os.environ.get("RAG_REFRESH_BUILD", "1") == "1"
+
+embedder_cfg = EmbedderConfig(
+    backend=os.environ.get("EMBED_BACKEND", "torch"),
+    batch_size=int(os.environ.get("EMBED_BATCH_SIZE", "64")),
+    num_threads=int(os.environ.get("EMBED_THREADS", "0")),
+)
+
+index_cfg = IndexConfig(
+    index_type=os.environ.get("RAG_INDEX_TYPE", "flat"),
+    hnsw=HnswConfig(
+        ef_search=int(os.environ.get("RAG_EF_SEARCH", "64")),
+        max_dead_share=float(os.environ.get("RAG_HNSW_MAX_DEAD_SHARE", "0.2")),
+    ),
+    ivfpq=IvfPqConfig(nprobe=int(os.environ.get("RAG_NPROBE", "16"))),
+)
+
+retrieval_cfg = RetrievalConfig(
+    hybrid=os.environ.get("RAG_HYBRID", "1") == "1",
+    context=ContextConfig(
+        top_k=int(os.environ.get("RAG_TOP_K", "8")),
+        context_tokens=int(os.environ.get("RAG_CONTEXT_TOKENS", "2000")),
+    ),
+)
+if os.environ.get("RAG_BOOSTS"):
+    retrieval_cfg.fusion.boosts = parse_boosts(os.environ["RAG_BOOSTS"])
+
+store_cfg = rag.StoreConfig(embedder_cfg, index_cfg, retrieval_cfg)
+build_cfg = rag.BuildConfig(
+    s3_cfg, cache_dir=RAG_CACHE_DIR, workers=RAG_INGEST_WORKERS, keep=RAG_INDEX_KEEP
+)
+
+
+def build_index(embedder=None):
+    """Собрать новую версию индекса в RAG_INDEX_DIR, если бакет изменился"""
+    return rag.build_version(build_cfg, RAG_INDEX_DIR, store_cfg, embedder)